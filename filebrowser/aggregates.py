@@ -0,0 +1,89 @@
+# coding: utf-8
+
+# PYTHON IMPORTS
+import os
+import hashlib
+
+# DJANGO IMPORTS
+from django.utils.encoding import force_bytes
+
+# FILEBROWSER IMPORTS
+from filebrowser.base import FileListing
+from filebrowser.cache import get_cache, get_generation
+from filebrowser.utils import get_directory_mtime
+
+
+class FolderAggregates(object):
+    """
+    Recursive sizes (in bytes) and item counts of the folders of a FileBrowserSite.
+
+    A folder is computed with one pass over its tree. The subtotals of
+    every directory (the size and number of its own items) are cached
+    with the modification time (and the generation, see get_generation)
+    of the directory, so only directories which have changed are listed
+    again (all others cost one stat).
+
+    All items are included (also hidden files and versions).
+
+    cache: see filebrowser.cache.get_cache.
+    """
+
+    def __init__(self, site, cache=None, timeout=None, max_entries=10000):
+        self.site = site
+        self.timeout = timeout
+        self.cache = get_cache(cache, timeout, max_entries)
+
+    def _generation_key(self, path):
+        digest = hashlib.md5(force_bytes(path.rstrip('/'))).hexdigest()
+        return 'filebrowser:aggregate-generation:%s:%s' % (self.site.name, digest)
+
+    def _key(self, path, mtime):
+        digest = hashlib.md5(force_bytes(path.rstrip('/'))).hexdigest()
+        generation = get_generation(self.cache, self._generation_key(path), self.timeout)
+        return 'filebrowser:aggregate:%s:%s:%r:%s' % (self.site.name, digest, mtime, generation)
+
+    def _subtotal(self, path):
+        "(size, count, subdirectories) of the items directly within path"
+        mtime = get_directory_mtime(self.site.storage, path)
+        subtotal = None
+        if mtime is not None:
+            key = self._key(path, mtime)
+            subtotal = self.cache.get(key)
+        if subtotal is None:
+            size = count = 0
+            subdirectories = []
+            for name, is_dir, entry_size, entry_mtime in FileListing(path, site=self.site).scandir():
+                count += 1
+                if is_dir:
+                    subdirectories.append(name)
+                    continue
+                if entry_size is None:
+                    entry_size = self.site.storage.size(os.path.join(path, name))
+                size += entry_size or 0
+            subtotal = (size, count, subdirectories)
+            if mtime is not None:
+                self.cache.set(key, subtotal, self.timeout)
+        return subtotal
+
+    def aggregate(self, path):
+        "Recursive (size in bytes, number of items) of the folder path"
+        size = count = 0
+        filelisting = FileListing(path, site=self.site)
+        visited = set()
+        pending = [path]
+        while pending:
+            current = pending.pop()
+            # symbolic links may create cycles
+            key = filelisting._directory_key(current)
+            if key in visited:
+                continue
+            visited.add(key)
+            subtotal_size, subtotal_count, subdirectories = self._subtotal(current)
+            size += subtotal_size
+            count += subtotal_count
+            pending.extend(os.path.join(current, name) for name in subdirectories)
+        return size, count
+
+    def invalidate(self, path):
+        "Remove the cached subtotal of the directory path (with any modification time)"
+        self.cache.delete(self._generation_key(path))
@@ -2,21 +2,28 @@
 
 # PYTHON IMPORTS
 import os
+import re
+import hashlib
 import datetime
 import time
 import platform
 import mimetypes
+import heapq
+from operator import attrgetter
+from multiprocessing.pool import ThreadPool
 from tempfile import NamedTemporaryFile
 import warnings
 
 # DJANGO IMPORTS
 from django.core.files import File
 from django.utils.six import string_types
+from django.utils.six.moves.queue import Queue
 
 # FILEBROWSER IMPORTS
-from filebrowser.settings import EXTENSIONS, VERSIONS, ADMIN_VERSIONS, VERSIONS_BASEDIR, VERSION_QUALITY, PLACEHOLDER, FORCE_PLACEHOLDER, SHOW_PLACEHOLDER, STRICT_PIL, IMAGE_MAXBLOCK, DEFAULT_PERMISSIONS
-from filebrowser.utils import path_strip, scale_and_crop
-from django.utils.encoding import python_2_unicode_compatible, smart_str
+from filebrowser.settings import EXTENSIONS, VERSIONS, ADMIN_VERSIONS, VERSIONS_BASEDIR, VERSION_QUALITY, PLACEHOLDER, FORCE_PLACEHOLDER, SHOW_PLACEHOLDER, STRICT_PIL, IMAGE_MAXBLOCK, DEFAULT_PERMISSIONS, WALK_WORKERS, PREFETCH_WORKERS, VERSION_REDUCING_GAP, VERSION_GENERATE_ASYNC, VERSION_NAMES_HASHED
+from filebrowser.utils import normalize_mtime, path_strip, scale_and_crop_plan, resize_image, draft_size, get_image_info, version_signature, VERSION_HASH_PATTERN
+from filebrowser.versions import version_lock
+from django.utils.encoding import python_2_unicode_compatible, smart_str, force_bytes
 
 # PIL import
 if STRICT_PIL:
@@ -32,6 +39,64 @@ else:
 
 ImageFile.MAXBLOCK = IMAGE_MAXBLOCK  # default is 64k
 
+IS_WINDOWS = platform.system() == 'Windows'
+
+# Lowercase extension -> filetype (as defined with EXTENSIONS)
+EXTENSION_FILETYPES = {}
+for filetype, extensions in EXTENSIONS.items():
+    for extension in extensions:
+        EXTENSION_FILETYPES[extension.lower()] = filetype
+
+# FileObject attributes which are derived from the name (and is_folder) only
+NAME_ATTRIBUTES = ('path', 'head', 'filename', 'filename_lower', 'filename_root', 'extension', 'mimetype', 'filetype')
+
+# Hash at the end of the filename root of a version (see VERSION_NAMES_HASHED)
+VERSION_HASH_RE = re.compile(VERSION_HASH_PATTERN + '$')
+
+
+class PartialSortedList(object):
+    """
+    A sorted sequence where only the first `limit` items are put in order
+    (using heapq), e.g. for the first pages of a paginated listing.
+
+    len() returns the total number of items. Accessing any item beyond
+    `limit` sorts the whole sequence.
+    """
+
+    def __init__(self, seq, key, reverse, limit):
+        self._seq = seq
+        self._key = key
+        self._reverse = reverse
+        self._limit = limit
+        self._sorted = None
+        if reverse:
+            # equal items in the same order as with sorted() and reverse()
+            self._head = heapq.nlargest(limit, reversed(seq), key=key)
+        else:
+            self._head = heapq.nsmallest(limit, seq, key=key)
+
+    def __len__(self):
+        return len(self._seq)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1 and stop <= self._limit:
+                return self._head[start:stop]
+        elif 0 <= index < self._limit:
+            return self._head[index]
+        return self._sorted_all()[index]
+
+    def __iter__(self):
+        return iter(self._sorted_all())
+
+    def _sorted_all(self):
+        if self._sorted is None:
+            self._sorted = sorted(self._seq, key=self._key)
+            if self._reverse:
+                self._sorted.reverse()
+        return self._sorted
+
 
 class FileListing():
     """
@@ -41,25 +106,35 @@ class FileListing():
 
         from filebrowser.base import FileListing
         filelisting = FileListing(path, sorting_by='date', sorting_order='desc')
-        print filelisting.files_listing_total()
-        print filelisting.results_listing_total()
+        print(filelisting.files_listing_total())
+        print(filelisting.results_listing_total())
         for fileobject in filelisting.files_listing_total():
-            print fileobject.filetype
+            print(fileobject.filetype)
 
     where path is a relative path to a storage location
+
+    With lazy=True and a listing which is not sorted by metadata (e.g. sorted by
+    filename_lower), the FileObjects are built from names only. Sizes, dates
+    and dimensions are then only retrieved for the files actually used.
+
+    filter_name_func is called with the filename of every item, before a
+    FileObject is built. Items are skipped entirely (also with the totals),
+    if it returns False.
     """
     # Four variables to store the length of a listing obtained by various listing methods
     # (updated whenever a particular listing method is called).
     _results_listing_total = None
     _results_walk_total = None
     _results_listing_filtered = None
-    _results_walk_total = None
+    _results_walk_filtered = None
 
-    def __init__(self, path, filter_func=None, sorting_by=None, sorting_order=None, site=None):
+    def __init__(self, path, filter_func=None, sorting_by=None, sorting_order=None, site=None, lazy=False, filter_name_func=None):
         self.path = path
         self.filter_func = filter_func
+        self.filter_name_func = filter_name_func
         self.sorting_by = sorting_by
         self.sorting_order = sorting_order
+        self.lazy = lazy
         if not site:
             from filebrowser.sites import site as default_site
             site = default_site
@@ -68,21 +143,42 @@ class FileListing():
     # HELPER METHODS
     # sort_by_attr
 
-    def sort_by_attr(self, seq, attr):
+    def sort_by_attr(self, seq, attr, reverse=False, limit=None):
         """
         Sort the sequence of objects by object's attribute
 
         Arguments:
         seq  - the list or any sequence (including immutable one) of objects to sort.
         attr - the name of attribute to sort by
+        reverse - sort in descending order
+        limit - only put the first limit objects in order (see PartialSortedList)
 
         Returns:
         the sorted list of objects.
         """
-        from operator import attrgetter
         if isinstance(attr, string_types):  # Backward compatibility hack
             attr = (attr, )
-        return sorted(seq, key=attrgetter(*attr))
+        if limit is not None and 0 < limit < len(seq):
+            return PartialSortedList(seq, attrgetter(*attr), reverse, limit)
+        seq = sorted(seq, key=attrgetter(*attr))
+        if reverse:
+            seq.reverse()
+        return seq
+
+    def sort(self, files, limit=None):
+        "Sort files according to sorting_by and sorting_order (see sort_by_attr for limit)"
+        if self.sorting_by:
+            return self.sort_by_attr(files, self.sorting_by, reverse=(self.sorting_order == "desc"), limit=limit)
+        if self.sorting_order == "desc":
+            return files[::-1]
+        return list(files)
+
+    def sorting_needs_metadata(self):
+        "True, if sorting_by requires storage metadata (and not just names)"
+        sorting_by = self.sorting_by or ()
+        if isinstance(sorting_by, string_types):
+            sorting_by = (sorting_by, )
+        return any(attr not in NAME_ATTRIBUTES for attr in sorting_by)
 
     _is_folder_stored = None
     @property
@@ -98,111 +194,381 @@ class FileListing():
             return (f for f in dirs + files)
         return []
 
-    def _walk(self, path, filelisting):
-        """
-        Recursively walks the path and collects all files and
-        directories.
+    def scandir(self):
+        "List all files for path as (name, is_dir, size, mtime), with one storage call"
+        if not self.is_folder:
+            return []
+        if hasattr(self.site.storage, 'scandir'):
+            try:
+                return self.site.storage.scandir(self.path)
+            except NotImplementedError:
+                pass
+        # storage without scandir: no metadata available
+        return self._listdir_entries()
+
+    def _listdir_entries(self):
+        "Entries like with scandir, but names and is_dir only"
+        if not self.is_folder:
+            return []
+        dirs, files = self.site.storage.listdir(self.path)
+        return [(d, True, None, None) for d in dirs] + [(f, False, None, None) for f in files]
+
+    def _fileobject(self, path, is_dir=None, size=None, mtime=None):
+        "FileObject for path, with the metadata of a directory listing already stored"
+        fileobject = FileObject(path, site=self.site)
+        if is_dir is not None:
+            fileobject._is_folder_stored = is_dir
+        if size is not None:
+            fileobject._exists_stored = True
+            fileobject._filesize_stored = size
+        if mtime is not None:
+            fileobject._date_stored = normalize_mtime(mtime)
+        return fileobject
+
+    def _cached_entries(self):
+        "Entries like with scandir, from the listing cache of the site (if possible)"
+        entries, key = self.site.listing_cache.get(self.path)
+        if entries is None:
+            entries = list(self.scandir())
+            self.site.listing_cache.set(key, entries)
+        return entries
 
-        Danger: Symbolic links can create cycles and this function
-        ends up in a regression.
+    @property
+    def metadata_index(self):
+        "The MetadataIndex of the site (None, if not used)"
+        return getattr(self.site, 'metadata_index', None)
+
+    def _index_entries(self):
+        "Entries like with scandir (plus width and height) from the updated metadata index"
+        if not self.is_folder:
+            return []
+        self.metadata_index.refresh(self.path)
+        # filtered by the database, but in the order of the storage: sort() is the only
+        # ordering step, so equal items are in the same order as without the index
+        return self.metadata_index.entries(self.path, filter_name_func=self.filter_name_func, versions=self._index_versions())
+
+    def _index_versions(self):
+        "False if versions are excluded with filter_name_func (skipped by the metadata index then)"
+        return self.filter_name_func is None or self.filter_name_func != getattr(self.site, 'filter_browse', None)
+
+    def _directory_key(self, path):
+        "(device, inode) of a directory, or the path itself if the storage is not local"
+        try:
+            st = os.stat(self.site.storage.path(path))
+        except (NotImplementedError, OSError):
+            return path
+        return (st.st_dev, st.st_ino)
+
+    def _walk(self, path, listdir=None):
         """
-        dirs, files = self.site.storage.listdir(path)
+        Walks the path (without recursion) and yields all files and
+        directories, each directory after its contents.
 
-        if dirs:
+        listdir(path) returns (dirs, files) for a directory, or None if the
+        directory should not be walked. By default, storage.listdir is used
+        and directories which have already been walked (e.g. with symbolic
+        links creating cycles) are yielded, but not walked again.
+        """
+        if listdir is None:
+            visited = set()
+
+            def listdir(dir_path):
+                key = self._directory_key(dir_path)
+                if key in visited:
+                    return None
+                visited.add(key)
+                return self.site.storage.listdir(dir_path)
+
+        dirs, files = listdir(path)
+        stack = [(path, iter(dirs), files)]
+        while stack:
+            current, dirs, files = stack[-1]
             for d in dirs:
-                self._walk(os.path.join(path, d), filelisting)
-                filelisting.extend([path_strip(os.path.join(path, d), self.site.directory)])
+                dir_path = os.path.join(current, d)
+                listing = listdir(dir_path)
+                if listing is None:
+                    yield path_strip(dir_path, self.site.directory)
+                    continue
+                stack.append((dir_path, iter(listing[0]), listing[1]))
+                break
+            else:
+                stack.pop()
+                for f in files:
+                    yield path_strip(os.path.join(current, f), self.site.directory)
+                if stack:
+                    yield path_strip(current, self.site.directory)
+
+    def _listdir_for_walk(self, path):
+        "(path, key, listing, error) for a directory, see _listdir_parallel"
+        try:
+            return path, self._directory_key(path), self.site.storage.listdir(path), None
+        except Exception as e:
+            return path, None, None, e
 
-        if files:
-            for f in files:
-                filelisting.extend([path_strip(os.path.join(path, f), self.site.directory)])
+    def _listdir_parallel(self, path, workers):
+        """
+        Lists the path and all its subdirectories with up to `workers`
+        concurrent storage.listdir calls, yielding (path, dirs, files) for
+        each directory as soon as it has been listed.
 
-    def walk(self):
-        "Walk all files for path"
-        filelisting = []
-        if self.is_folder:
-            self._walk(self.path, filelisting)
-        return filelisting
+        Directories which have already been listed are skipped (see _walk).
+        """
+        results = Queue()
+        pool = ThreadPool(workers)
+        try:
+            visited = set()
+            pool.apply_async(self._listdir_for_walk, (path, ), callback=results.put)
+            pending = 1
+            while pending:
+                dir_path, key, listing, error = results.get()
+                pending -= 1
+                if error is not None:
+                    raise error
+                if key in visited:
+                    continue
+                visited.add(key)
+                dirs, files = listing
+                for d in dirs:
+                    pool.apply_async(self._listdir_for_walk, (os.path.join(dir_path, d), ), callback=results.put)
+                    pending += 1
+                yield dir_path, dirs, files
+        finally:
+            pool.terminate()
+
+    def _walk_parallel(self, path, workers, ordered):
+        """
+        Walks the path with up to `workers` concurrent storage calls.
+
+        With ordered=True, the items are yielded in the same order as with
+        _walk (once all directories have been listed). Otherwise, the items
+        of a directory are yielded as soon as it has been listed.
+        """
+        if ordered:
+            listings = {}
+            for dir_path, dirs, files in self._listdir_parallel(path, workers):
+                listings[dir_path] = (dirs, files)
+            for item in self._walk(path, listdir=listings.get):
+                yield item
+        else:
+            for dir_path, dirs, files in self._listdir_parallel(path, workers):
+                for name in dirs + files:
+                    yield path_strip(os.path.join(dir_path, name), self.site.directory)
+
+    def walk(self, workers=None, ordered=True):
+        """
+        Walk all files for path (returns an iterator)
+
+        With workers > 1 (defaults to WALK_WORKERS), directories are listed
+        concurrently. Use ordered=False in order to get the items as soon as
+        their directory has been listed (in no particular order).
+        """
+        if not self.is_folder:
+            return []
+        if workers is None:
+            workers = WALK_WORKERS
+        if workers > 1:
+            return self._walk_parallel(self.path, workers, ordered)
+        return self._walk(self.path)
 
     # Cached results of files_listing_total (without any filters and sorting applied)
     _fileobjects_total = None
 
     def files_listing_total(self):
         "Returns FileObjects for all files in listing"
+        return self.sort(self._files_listing_total())
+
+    # Cached results of listing_entries
+    _entries_stored = None
+
+    def listing_entries(self):
+        "Entries like with scandir (from the listing cache of the site, names only with lazy)"
+        if self._entries_stored is None:
+            if getattr(self.site, 'listing_cache', None) is not None:
+                entries = self._cached_entries()
+            elif self.lazy and not self.sorting_needs_metadata():
+                entries = self._listdir_entries()
+            else:
+                entries = self.scandir()
+            self._entries_stored = list(entries)
+        return self._entries_stored
+
+    def _files_listing_total(self):
+        "Unsorted FileObjects for all files in listing"
+        if self._fileobjects_total is None and self.metadata_index is not None:
+            self._fileobjects_total = []
+            for name, is_dir, size, mtime, width, height in self._index_entries():
+                fileobject = self._fileobject(os.path.join(self.path, name), is_dir, size, mtime)
+                if width is not None:
+                    fileobject._dimensions_stored = (width, height)
+                self._fileobjects_total.append(fileobject)
         if self._fileobjects_total is None:
             self._fileobjects_total = []
-            for item in self.listing():
-                fileobject = FileObject(os.path.join(self.path, item), site=self.site)
+            for name, is_dir, size, mtime in self.listing_entries():
+                if self.filter_name_func and not self.filter_name_func(name):
+                    continue
+                fileobject = self._fileobject(os.path.join(self.path, name), is_dir, size, mtime)
                 self._fileobjects_total.append(fileobject)
-
-        files = self._fileobjects_total
-
-        if self.sorting_by:
-            files = self.sort_by_attr(files, self.sorting_by)
-        if self.sorting_order == "desc":
-            files.reverse()
-
-        self._results_listing_total = len(files)
-        return files
+        self._results_listing_total = len(self._fileobjects_total)
+        return self._fileobjects_total
 
     def files_walk_total(self):
         "Returns FileObjects for all files in walk"
-        files = []
-        for item in self.walk():
-            fileobject = FileObject(os.path.join(self.site.directory, item), site=self.site)
-            files.append(fileobject)
-        if self.sorting_by:
-            files = self.sort_by_attr(files, self.sorting_by)
-        if self.sorting_order == "desc":
-            files.reverse()
+        return self.sort(self._files_walk_total())
+
+    def _files_walk_total(self):
+        "Unsorted FileObjects for all files in walk"
+        files = list(self._walk_fileobjects())
         self._results_walk_total = len(files)
         return files
 
-    def files_listing_filtered(self):
-        "Returns FileObjects for filtered files in listing"
+    def _walk_fileobjects(self, ordered=True):
+        "Yields FileObjects for all files in walk, while walking"
+        for item in self.walk(ordered=ordered):
+            if self.filter_name_func and not self.filter_name_func(os.path.basename(item)):
+                continue
+            yield FileObject(os.path.join(self.site.directory, item), site=self.site)
+
+    def files_walk_iterator(self, ordered=True):
+        "Yields unsorted FileObjects for filtered files in walk, while walking (see walk for ordered)"
         if self.filter_func:
-            listing = list(filter(self.filter_func, self.files_listing_total()))
-        else:
-            listing = self.files_listing_total()
-        self._results_listing_filtered = len(listing)
-        return listing
+            return (fileobject for fileobject in self._walk_fileobjects(ordered) if self.filter_func(fileobject))
+        return self._walk_fileobjects(ordered)
 
-    def files_walk_filtered(self):
-        "Returns FileObjects for filtered files in walk"
+    def files_listing_filtered(self, sort=True):
+        "Returns FileObjects for filtered files in listing (unsorted with sort=False)"
+        listing = self._files_listing_total()
         if self.filter_func:
-            listing = list(filter(self.filter_func, self.files_walk_total()))
-        else:
-            listing = self.files_walk_total()
+            listing = list(filter(self.filter_func, listing))
+        self._results_listing_filtered = len(listing)
+        if sort:
+            return self.sort(listing)
+        return list(listing)
+
+    def files_walk_filtered(self, sort=True):
+        "Returns FileObjects for filtered files in walk (unsorted with sort=False)"
+        listing = list(self.files_walk_iterator())
         self._results_walk_filtered = len(listing)
+        if sort:
+            return self.sort(listing)
         return listing
 
+    # COUNTERS
+    # Items are counted without sorting, and without FileObjects
+    # (unless a filter_func is used)
+
+    def _counting_entries(self):
+        "Entries for counting (names only, unless listing_entries has already been called)"
+        if self._entries_stored is not None or getattr(self.site, 'listing_cache', None) is not None:
+            entries = self.listing_entries()
+        else:
+            entries = self._listdir_entries()
+        if self.filter_name_func:
+            return [entry for entry in entries if self.filter_name_func(entry[0])]
+        return entries
+
     def results_listing_total(self):
         "Counter: all files"
         if self._results_listing_total is not None:
             return self._results_listing_total
-        return len(self.files_listing_total())
+        if self.metadata_index is not None and self.is_folder:
+            self.metadata_index.refresh(self.path)
+            self._results_listing_total = self.metadata_index.count(self.path, filter_name_func=self.filter_name_func, versions=self._index_versions())
+            return self._results_listing_total
+        self._results_listing_total = len(self._counting_entries())
+        return self._results_listing_total
 
     def results_walk_total(self):
         "Counter: all files"
         if self._results_walk_total is not None:
             return self._results_walk_total
-        return len(self.files_walk_total())
+        count = 0
+        for item in self.walk(ordered=False):
+            if not self.filter_name_func or self.filter_name_func(os.path.basename(item)):
+                count += 1
+        self._results_walk_total = count
+        return count
 
     def results_listing_filtered(self):
         "Counter: filtered files"
         if self._results_listing_filtered is not None:
             return self._results_listing_filtered
-        return len(self.files_listing_filtered())
+        if not self.filter_func:
+            return self.results_listing_total()
+        count = 0
+        for name, is_dir, size, mtime in self._counting_entries():
+            if self.filter_func(self._fileobject(os.path.join(self.path, name), is_dir, size, mtime)):
+                count += 1
+        self._results_listing_filtered = count
+        return count
 
     def results_walk_filtered(self):
         "Counter: filtered files"
         if self._results_walk_filtered is not None:
             return self._results_walk_filtered
-        return len(self.files_walk_filtered())
+        if not self.filter_func:
+            return self.results_walk_total()
+        self._results_walk_filtered = sum(1 for fileobject in self.files_walk_iterator(ordered=False))
+        return self._results_walk_filtered
+
+    def files_walk_head(self, limit):
+        """
+        The first limit FileObjects of the sorted walk and the number of all
+        items, e.g. for a preview of a large folder. Only limit FileObjects
+        are kept while walking.
+        """
+        count = [0]
+
+        def counted(iterable):
+            for item in iterable:
+                count[0] += 1
+                yield item
+
+        files = counted(self.files_walk_iterator(ordered=False))
+        if self.sorting_by:
+            attrs = self.sorting_by
+            if isinstance(attrs, string_types):
+                attrs = (attrs, )
+            select = self.sorting_order == "desc" and heapq.nlargest or heapq.nsmallest
+            head = select(limit, files, key=attrgetter(*attrs))
+        else:
+            head = list(files)
+            head = self.sort(head)[:limit]
+        # consume the rest of the walk for the count
+        for fileobject in files:
+            pass
+        return head, count[0]
+
+    def prefetch(self, fileobjects, fields=('filesize', 'date', 'dimensions'), versions=(), workers=None):
+        """
+        Retrieves attributes (fields) and versions (suffixes, for images) of
+        fileobjects, e.g. for the current page with browse. The values are
+        stored with the FileObjects, so rendering a template does not access
+        the storage again.
+
+        With workers > 1 (defaults to PREFETCH_WORKERS), up to workers
+        FileObjects are handled concurrently. Returns fileobjects as list.
+        """
+        if workers is None:
+            workers = PREFETCH_WORKERS
+        fileobjects = list(fileobjects)
+
+        def prefetch_fileobject(fileobject):
+            fileobject._prefetch(fields, versions)
+
+        if workers > 1 and len(fileobjects) > 1:
+            pool = ThreadPool(min(workers, len(fileobjects)))
+            try:
+                pool.map(prefetch_fileobject, fileobjects, chunksize=1)
+            finally:
+                pool.terminate()
+        else:
+            for fileobject in fileobjects:
+                prefetch_fileobject(fileobject)
+        return fileobjects
 
 
 @python_2_unicode_compatible
-class FileObject():
+class FileObject(object):
     """
     The FileObject represents a file (or directory) on the server.
 
@@ -214,12 +580,18 @@ class FileObject():
     where path is a relative path to a storage location
     """
 
+    # No instance __dict__ (walks may create a lot of FileObjects)
+    __slots__ = ('site', 'path', 'head', 'filename', 'filename_lower', 'filename_root', 'extension',
+                 '_mimetype_stored', '_filetype_stored', '_filesize_stored', '_date_stored', '_exists_stored',
+                 '_dimensions_stored', '_image_info_stored', '_is_folder_stored', '_folder_aggregate_stored',
+                 '_versions_stored')
+
     def __init__(self, path, site=None):
         if not site:
             from filebrowser.sites import site as default_site
             site = default_site
         self.site = site
-        if platform.system() == 'Windows':
+        if IS_WINDOWS:
             self.path = path.replace('\\', '/')
         else:
             self.path = path
@@ -227,7 +599,33 @@ class FileObject():
         self.filename = os.path.basename(path)
         self.filename_lower = self.filename.lower()
         self.filename_root, self.extension = os.path.splitext(self.filename)
-        self.mimetype = mimetypes.guess_type(self.filename)
+        self._mimetype_stored = None
+        self._filetype_stored = None
+        self._filesize_stored = None
+        self._date_stored = None
+        self._exists_stored = None
+        self._dimensions_stored = None
+        self._image_info_stored = None
+        self._is_folder_stored = None
+        self._folder_aggregate_stored = None
+        self._versions_stored = None
+
+    def __getstate__(self):
+        # the site is pickled by name (and resolved with the deployed sites again)
+        state = dict((attr, getattr(self, attr)) for attr in self.__slots__ if attr != 'site')
+        state['site'] = (getattr(self.site, 'app_name', 'filebrowser'), self.site.name)
+        return state
+
+    def __setstate__(self, state):
+        from filebrowser.sites import get_site_dict
+        app_name, name = state.pop('site')
+        site = get_site_dict(app_name).get(name)
+        if site is None:
+            from filebrowser.sites import site as default_site
+            site = default_site
+        self.site = site
+        for attr, value in state.items():
+            setattr(self, attr, value)
 
     def __str__(self):
         return smart_str(self.path)
@@ -244,24 +642,51 @@ class FileObject():
 
     # HELPER METHODS
     # _get_file_type
+    # _prefetch
 
     def _get_file_type(self):
         "Get file type as defined in EXTENSIONS."
-        file_type = ''
-        for k, v in EXTENSIONS.items():
-            for extension in v:
-                if self.extension.lower() == extension.lower():
-                    file_type = k
-        return file_type
+        return EXTENSION_FILETYPES.get(self.extension.lower(), '')
+
+    def _prefetch(self, fields, versions):
+        "Retrieve attributes and versions (see FileListing.prefetch). Errors are raised when used again."
+        for field in fields:
+            try:
+                getattr(self, field)
+            except Exception:
+                pass
+        if versions and self.filetype == 'Image':
+            if self._versions_stored is None:
+                self._versions_stored = {}
+            versions = [suffix for suffix in versions if suffix in VERSIONS]
+            try:
+                if VERSION_GENERATE_ASYNC:
+                    # missing versions are generated in the background (see templatetags)
+                    for version_suffix in versions:
+                        version = self.version_get(version_suffix)
+                        if version is not None:
+                            self._versions_stored[version_suffix] = version
+                else:
+                    # with a single decode of the image
+                    self._versions_stored.update(self.versions_generate(versions))
+            except Exception:
+                pass
 
     # GENERAL ATTRIBUTES/PROPERTIES
+    # mimetype
     # filetype
     # filesize
     # date
     # datetime
     # exists
 
-    _filetype_stored = None
+    @property
+    def mimetype(self):
+        "Mimetype as a tuple (type, encoding), see mimetypes.guess_type"
+        if self._mimetype_stored is None:
+            self._mimetype_stored = mimetypes.guess_type(self.filename)
+        return self._mimetype_stored
+
     @property
     def filetype(self):
         "Filetype as defined with EXTENSIONS"
@@ -273,7 +698,6 @@ class FileObject():
             self._filetype_stored = self._get_file_type()
         return self._filetype_stored
 
-    _filesize_stored = None
     @property
     def filesize(self):
         "Filesize in bytes"
@@ -284,7 +708,6 @@ class FileObject():
             return self._filesize_stored
         return None
 
-    _date_stored = None
     @property
     def date(self):
         "Modified time (from site.storage) as float (mktime)"
@@ -302,7 +725,6 @@ class FileObject():
             return datetime.datetime.fromtimestamp(self.date)
         return None
 
-    _exists_stored = None
     @property
     def exists(self):
         "True, if the path exists, False otherwise"
@@ -343,8 +765,9 @@ class FileObject():
     # height
     # aspectratio
     # orientation
+    # image_format
+    # image_mode
 
-    _dimensions_stored = None
     @property
     def dimensions(self):
         "Image dimensions as a tuple"
@@ -353,12 +776,70 @@ class FileObject():
         if self._dimensions_stored is not None:
             return self._dimensions_stored
         try:
-            im = Image.open(self.site.storage.open(self.path))
-            self._dimensions_stored = im.size
+            self._dimensions_stored = tuple(self._image_info()[:2])
+            metadata_index = getattr(self.site, 'metadata_index', None)
+            if metadata_index is not None:
+                metadata_index.set_dimensions(self.path, self._dimensions_stored)
         except:
             pass
         return self._dimensions_stored
 
+    def _image_info(self):
+        """
+        (width, height, format, mode) of the image, either from the image
+        metadata cache of the site or read from the file.
+        """
+        if self._image_info_stored is not None:
+            return self._image_info_stored
+        image_metadata = getattr(self.site, 'image_metadata', None)
+        size = mtime = None
+        if image_metadata is not None:
+            size, mtime = self.filesize, self.date
+        if mtime is None:
+            # no cache (or no key for the cache)
+            self._image_info_stored = self._read_image_info()
+            return self._image_info_stored
+        info = image_metadata.get(self.path, size, mtime)
+        if info is None:
+            info = self._read_image_info()
+            image_metadata.set(self.path, size, mtime, info)
+        self._image_info_stored = info
+        return info
+
+    def _read_image_info(self):
+        """
+        (width, height, format, mode) parsed from the header of the image (with
+        ranged reads if the storage supports them), with PIL as fallback for
+        other formats.
+        """
+        storage = self.site.storage
+        # storages without StorageMixin.read_range read from an open file
+        read_range = getattr(storage, 'read_range', None)
+        f = None
+        try:
+            if read_range is not None:
+                try:
+                    info = get_image_info(lambda offset, length: read_range(self.path, offset, length))
+                except NotImplementedError:
+                    read_range = None
+            if read_range is None:
+                f = storage.open(self.path)
+
+                def read(offset, length):
+                    f.seek(offset)
+                    return f.read(length)
+                info = get_image_info(read)
+            if info is None:
+                if f is None:
+                    f = storage.open(self.path)
+                f.seek(0)
+                im = Image.open(f)
+                info = im.size + (im.format, im.mode)
+            return tuple(info)
+        finally:
+            if f is not None:
+                f.close()
+
     @property
     def width(self):
         "Image width in px"
@@ -390,11 +871,33 @@ class FileObject():
                 return "Portrait"
         return None
 
+    @property
+    def image_format(self):
+        "Image format (like with PIL, e.g. 'JPEG')"
+        if self.filetype != 'Image':
+            return None
+        try:
+            return self._image_info()[2]
+        except:
+            return None
+
+    @property
+    def image_mode(self):
+        "Image mode (like with PIL, e.g. 'RGB'), None if it is not known from the header"
+        if self.filetype != 'Image':
+            return None
+        try:
+            return self._image_info()[3]
+        except:
+            return None
+
     # FOLDER ATTRIBUTES/PROPERTIES
     # directory (deprecated)
     # folder (deprecated)
     # is_folder
     # is_empty
+    # folder_size
+    # folder_count
 
     @property
     def directory(self):
@@ -408,7 +911,6 @@ class FileObject():
         warnings.warn("directory will be removed with 3.6, use dirname instead.", DeprecationWarning)
         return os.path.dirname(path_strip(os.path.join(self.head, ''), self.site.directory))
 
-    _is_folder_stored = None
     @property
     def is_folder(self):
         "True, if path is a folder"
@@ -420,24 +922,62 @@ class FileObject():
     def is_empty(self):
         "True, if folder is empty. False otherwise, or if the object is not a folder."
         if self.is_folder:
+            if hasattr(self.site.storage, 'has_children'):
+                try:
+                    return not self.site.storage.has_children(self.path)
+                except NotImplementedError:
+                    pass
             dirs, files = self.site.storage.listdir(self.path)
             if not dirs and not files:
                 return True
         return False
 
+    def _folder_aggregate(self):
+        "Recursive (size, count) of a folder, see FolderAggregates"
+        if self._folder_aggregate_stored is None:
+            aggregates = getattr(self.site, 'folder_aggregates', None)
+            if aggregates is None:
+                from filebrowser.aggregates import FolderAggregates
+                aggregates = FolderAggregates(self.site)
+            self._folder_aggregate_stored = aggregates.aggregate(self.path)
+        return self._folder_aggregate_stored
+
+    @property
+    def folder_size(self):
+        "Recursive size of a folder in bytes (filesize for files, e.g. for sorting)"
+        if not self.is_folder:
+            return self.filesize
+        return self._folder_aggregate()[0]
+
+    @property
+    def folder_count(self):
+        "Recursive number of items within a folder (0 for files)"
+        if not self.is_folder:
+            return 0
+        return self._folder_aggregate()[1]
+
     # VERSION ATTRIBUTES/PROPERTIES
     # is_version
     # versions_basedir
     # original
     # original_filename
 
+    def _split_version(self):
+        "(filename root of the original, version suffix) if file is a version, None otherwise"
+        root = self.filename_root
+        # also versions with a hash (see VERSION_NAMES_HASHED)
+        match = VERSION_HASH_RE.search(root)
+        if match:
+            root = root[:match.start()]
+        tmp = root.split("_")
+        if tmp[len(tmp) - 1] in VERSIONS:
+            return root[:-len(tmp[len(tmp) - 1]) - 1], tmp[len(tmp) - 1]
+        return None
+
     @property
     def is_version(self):
         "True if file is a version, false otherwise"
-        tmp = self.filename_root.split("_")
-        if tmp[len(tmp) - 1] in VERSIONS:
-            return True
-        return False
+        return self._split_version() is not None
 
     @property
     def versions_basedir(self):
@@ -460,9 +1000,9 @@ class FileObject():
     @property
     def original_filename(self):
         "Get the filename of an original image from a version"
-        tmp = self.filename_root.split("_")
-        if tmp[len(tmp) - 1] in VERSIONS:
-            return u"%s%s" % (self.filename_root.replace("_%s" % tmp[len(tmp) - 1], ""), self.extension)
+        split = self._split_version()
+        if split is not None:
+            return u"%s%s" % (split[0], self.extension)
         return self.filename
 
     # VERSION METHODS
@@ -470,7 +1010,9 @@ class FileObject():
     # admin_versions()
     # version_name(suffix)
     # version_path(suffix)
+    # version_is_fresh(suffix)
     # version_generate(suffix)
+    # versions_generate(suffixes)
 
     def versions(self):
         "List of versions (not checking if they actually exist)"
@@ -489,44 +1031,187 @@ class FileObject():
         return version_list
 
     def version_name(self, version_suffix):
-        "Name of a version"  # FIXME: version_name for version?
+        "Name of a version (including version_hash with VERSION_NAMES_HASHED)"  # FIXME: version_name for version?
+        if VERSION_NAMES_HASHED:
+            return self._version_name(version_suffix, self.version_hash(version_suffix))
+        return self._version_name(version_suffix)
+
+    def _version_name(self, version_suffix, version_hash=None):
+        if version_hash:
+            return u"%s_%s.%s%s" % (self.filename_root, version_suffix, version_hash, self.extension)
         return self.filename_root + "_" + version_suffix + self.extension
 
+    def version_hash(self, version_suffix):
+        "Hash of size and modification time of the original and the settings of a version (see VERSION_NAMES_HASHED)"
+        # modification time in whole seconds, the same with a listing and with storage.modified_time
+        date = self.date
+        if date is not None:
+            date = int(date)
+        signature = '%r:%r:%s:%r' % (self.filesize, date, version_signature(VERSIONS[version_suffix]), VERSION_QUALITY)
+        return hashlib.md5(force_bytes(signature)).hexdigest()[:12]
+
     def version_path(self, version_suffix):
         "Path to a version (relative to storage location)"  # FIXME: version_path for version?
         return os.path.join(self.versions_basedir, self.dirname, self.version_name(version_suffix))
 
-    def version_generate(self, version_suffix):
-        "Generate a version"  # FIXME: version_generate for version?
-        path = self.path
+    def version_is_fresh(self, version_suffix):
+        "True, if the version exists and is not older than the original"
         version_path = self.version_path(version_suffix)
         if not self.site.storage.isfile(version_path):
-            version_path = self._generate_version(version_suffix)
-        elif self.site.storage.modified_time(path) > self.site.storage.modified_time(version_path):
-            version_path = self._generate_version(version_suffix)
-        return FileObject(version_path, site=self.site)
+            return False
+        if VERSION_NAMES_HASHED:
+            # a new original (or new settings) result with a new name
+            return True
+        return self.site.storage.modified_time(self.path) <= self.site.storage.modified_time(version_path)
+
+    def version_generate(self, version_suffix):
+        """
+        Generate a version (if it does not exist or is outdated).
+        With a version manifest (see VERSION_MANIFEST), versions known to be
+        up to date are returned without accessing the storage.
+        """  # FIXME: version_generate for version?
+        version = self.version_get(version_suffix)
+        if version is None:
+            version = self.versions_generate([version_suffix])[version_suffix]
+        return version
+
+    def version_get(self, version_suffix):
+        "The version if it exists and is up to date (None otherwise), without generating it"
+        version = self._recorded_version(version_suffix)
+        if version is None and self.version_is_fresh(version_suffix):
+            version = self._record_version(version_suffix, self.version_path(version_suffix))
+        return version
+
+    def versions_generate(self, version_suffixes=None):
+        """
+        Generate versions (defaults to all VERSIONS), like version_generate.
+        Missing/outdated versions are generated from a single decode of the original,
+        by one thread/process at a time (see VersionLock). Others wait and return
+        the versions generated meanwhile.
+        Returns a dict version_suffix -> FileObject.
+        """
+        if version_suffixes is None:
+            version_suffixes = sorted(VERSIONS)
+        versions = {}
+        pending = []
+        for version_suffix in version_suffixes:
+            version = self.version_get(version_suffix)
+            if version is not None:
+                versions[version_suffix] = version
+            else:
+                pending.append(version_suffix)
+        if pending:
+            with version_lock.hold(self.site, self.path) as waited:
+                if waited:
+                    # versions generated while waiting for the lock
+                    for version_suffix in list(pending):
+                        version = self.version_get(version_suffix)
+                        if version is not None:
+                            versions[version_suffix] = version
+                            pending.remove(version_suffix)
+                if pending:
+                    for version_suffix, version_path in self._generate_versions(pending).items():
+                        versions[version_suffix] = self._record_version(version_suffix, version_path)
+        return versions
+
+    def _recorded_version(self, version_suffix):
+        "Version from the version manifest of the site (or None)"
+        version_manifest = getattr(self.site, 'version_manifest', None)
+        if version_manifest is not None:
+            entry = version_manifest.get(self.path, self.date, version_suffix)
+            if entry is not None:
+                version = FileObject(entry[0], site=self.site)
+                version._date_stored = entry[1]
+                return version
+        return None
+
+    def _record_version(self, version_suffix, version_path):
+        "FileObject for a version, recorded with the version manifest of the site (if any)"
+        version = FileObject(version_path, site=self.site)
+        version_manifest = getattr(self.site, 'version_manifest', None)
+        if version_manifest is not None and version_path:
+            version_manifest.set(self.path, self.date, version_suffix, version_path, version.date)
+        return version
 
     def _generate_version(self, version_suffix):
         """
         Generate Version for an Image.
         value has to be a path relative to the storage location.
         """
+        return self._generate_versions([version_suffix])[version_suffix]
 
-        tmpfile = File(NamedTemporaryFile())
-
+    def _generate_versions(self, version_suffixes):
+        """
+        Generate versions from a single decode of the original image.
+        Versions are scaled from the largest to the smallest one, each from
+        the smallest (uncropped) version already scaled which is large enough.
+        With a reducing_gap for all versions (see VERSION_REDUCING_GAP), JPEGs
+        are decoded with DCT scaling (see utils.resize_image).
+        Returns a dict version_suffix -> path ("" if the original can not be opened).
+        """
         try:
             f = self.site.storage.open(self.path)
         except IOError:
-            return ""
-        im = Image.open(f)
+            return dict((version_suffix, "") for version_suffix in version_suffixes)
+        try:
+            im = Image.open(f)
+            original_size = im.size
+            plans = []
+            minimum_size = (0, 0)
+            for version_suffix in version_suffixes:
+                plan = scale_and_crop_plan(im.size, VERSIONS[version_suffix]['width'], VERSIONS[version_suffix]['height'], VERSIONS[version_suffix]['opts'])
+                reducing_gap = VERSIONS[version_suffix].get('reducing_gap', VERSION_REDUCING_GAP)
+                plans.append((version_suffix, plan, reducing_gap))
+                if minimum_size is not None and plan and plan[0] and reducing_gap:
+                    required = draft_size(plan[0], reducing_gap)
+                    minimum_size = (max(minimum_size[0], required[0]), max(minimum_size[1], required[1]))
+                else:
+                    # the original size is required
+                    minimum_size = None
+            if minimum_size is not None and im.format == 'JPEG':
+                im.draft(im.mode, minimum_size)
+            im.load()
+        finally:
+            f.close()
+
+        # largest versions first
+        plans.sort(key=lambda item: item[1] and item[1][0] and item[1][0][0] * item[1][0][1] or 0, reverse=True)
+
+        scaled = []
+        version_paths = {}
+        for version_suffix, plan, reducing_gap in plans:
+            version = im
+            if plan:
+                resize, crop = plan
+                if resize:
+                    source = im
+                    for candidate in scaled:
+                        if candidate.size[0] >= resize[0] and candidate.size[1] >= resize[1]:
+                            source = candidate
+                    version = resize_image(source, resize, reducing_gap)
+                    if resize[0] <= original_size[0]:
+                        scaled.append(version)
+                if crop:
+                    version = version.crop(crop)
+            # by identity (PIL images compare their pixels)
+            shared = version is im or any(version is candidate for candidate in scaled)
+            version_paths[version_suffix] = self._save_version(version, version_suffix, shared)
+        return version_paths
+
+    def _save_version(self, version, version_suffix, shared=False):
+        """
+        Apply the methods of a version (see VERSIONS) and save it.
+        With shared=True, the methods get a copy of version.
+        Returns the path of the version.
+        """
+        tmpfile = File(NamedTemporaryFile())
         version_path = self.version_path(version_suffix)
         version_dir, version_basename = os.path.split(version_path)
         root, ext = os.path.splitext(version_basename)
-        version = scale_and_crop(im, VERSIONS[version_suffix]['width'], VERSIONS[version_suffix]['height'], VERSIONS[version_suffix]['opts'])
-        if not version:
-            version = im
         # version methods as defined with VERSIONS
         if 'methods' in VERSIONS[version_suffix].keys():
+            if shared:
+                version = version.copy()
             for m in VERSIONS[version_suffix]['methods']:
                 if callable(m):
                     version = m(version)
@@ -535,13 +1220,23 @@ class FileObject():
             version.save(tmpfile, format=Image.EXTENSION[ext.lower()], quality=VERSION_QUALITY, optimize=(os.path.splitext(version_path)[1] != '.gif'))
         except IOError:
             version.save(tmpfile, format=Image.EXTENSION[ext.lower()], quality=VERSION_QUALITY)
-        # remove old version, if any
-        if version_path != self.site.storage.get_available_name(version_path):
-            self.site.storage.delete(version_path)
-        self.site.storage.save(version_path, tmpfile)
+        # replace an old version atomically (with storages supporting it, see StorageMixin)
+        atomic_save = getattr(self.site.storage, 'atomic_save', None)
+        if atomic_save is not None:
+            try:
+                atomic_save(version_path, tmpfile)
+            except NotImplementedError:
+                atomic_save = None
+        if atomic_save is None:
+            # remove old version, if any
+            if version_path != self.site.storage.get_available_name(version_path):
+                self.site.storage.delete(version_path)
+            self.site.storage.save(version_path, tmpfile)
         # set permissions
         if DEFAULT_PERMISSIONS is not None:
             os.chmod(self.site.storage.path(version_path), DEFAULT_PERMISSIONS)
+        # outdated versions (with another hash) are not removed here, another
+        # process might still use them (see fb_version_migrate)
         return version_path
 
     # DELETE METHODS
@@ -558,7 +1253,8 @@ class FileObject():
 
     def delete_versions(self):
         "Delete versions"
-        for version in self.versions():
+        self._invalidate_versions(VERSIONS)
+        for version in set(self.versions() + self._stored_versions(VERSIONS)):
             try:
                 self.site.storage.delete(version)
             except:
@@ -566,8 +1262,29 @@ class FileObject():
 
     def delete_admin_versions(self):
         "Delete admin versions"
-        for version in self.admin_versions():
+        self._invalidate_versions(ADMIN_VERSIONS)
+        for version in set(self.admin_versions() + self._stored_versions(ADMIN_VERSIONS)):
             try:
                 self.site.storage.delete(version)
             except:
                 pass
+
+    def _stored_versions(self, version_suffixes):
+        "Paths of all existing versions with VERSION_NAMES_HASHED, also outdated ones (and versions without a hash)"
+        if not VERSION_NAMES_HASHED or self.filetype != "Image" or self.is_version:
+            return []
+        version_dir = os.path.join(self.versions_basedir, self.dirname)
+        version_re = re.compile(r'^%s_(?:%s)(?:%s)?%s$' % (
+            re.escape(self.filename_root), '|'.join(re.escape(suffix) for suffix in version_suffixes),
+            VERSION_HASH_PATTERN, re.escape(self.extension)))
+        try:
+            filenames = self.site.storage.listdir(version_dir)[1]
+        except OSError:
+            return []
+        return [os.path.join(version_dir, filename) for filename in filenames if version_re.match(filename)]
+
+    def _invalidate_versions(self, version_suffixes):
+        "Remove versions from the version manifest of the site (if any)"
+        version_manifest = getattr(self.site, 'version_manifest', None)
+        if version_manifest is not None:
+            version_manifest.invalidate(self.path, version_suffixes)
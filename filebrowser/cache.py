@@ -0,0 +1,135 @@
+# coding: utf-8
+
+# PYTHON IMPORTS
+import time
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+
+# DJANGO IMPORTS
+from django.utils.encoding import force_bytes
+try:
+    from django.core.cache import caches
+
+    def get_django_cache(alias):
+        return caches[alias]
+except ImportError:
+    from django.core.cache import get_cache as get_django_cache
+
+# FILEBROWSER IMPORTS
+from filebrowser.utils import get_directory_mtime
+
+
+class LRUCache(object):
+    """
+    A thread-safe in-process cache with a timeout and a maximum number of
+    entries (the least recently used entries are removed first).
+
+    Implements get/set/delete like a Django cache.
+    """
+
+    def __init__(self, timeout=300, max_entries=1000):
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                return default
+            if expires is not None and expires < time.time():
+                return default
+            self._data[key] = (expires, value)
+            return value
+
+    def set(self, key, value, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        expires = timeout and time.time() + timeout or None
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (expires, value)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def get_cache(cache=None, timeout=300, max_entries=1000):
+    """
+    The cache of ListingCache, FolderAggregates and VersionManifest: the
+    Django cache with the alias cache or, with None, an in-process LRUCache
+    (which is not shared with other processes).
+    """
+    if cache:
+        return get_django_cache(cache)
+    return LRUCache(timeout=timeout, max_entries=max_entries)
+
+
+def get_generation(cache, key, timeout=None):
+    """
+    The generation (a random token) stored with key, created if missing.
+    Entries cached with the generation in their keys are invalidated by
+    deleting key, also if the modification time in their keys has changed
+    meanwhile (and if key has been evicted).
+    """
+    generation = cache.get(key)
+    if generation is None:
+        generation = uuid.uuid4().hex
+        cache.set(key, generation, timeout)
+    return generation
+
+
+class ListingCache(object):
+    """
+    Caches the entries of directory listings (see FileListing.scandir)
+    for a FileBrowserSite, across requests.
+
+    Keys are built with the name of the site, the path, the modification
+    time and the generation of the directory (see get_generation). With
+    local storages, a cached listing therefore costs one stat (and two
+    cache lookups). Changes which do not update the modification time (or
+    storages without one) require invalidate (see the views of the site).
+
+    cache is a Django cache alias or None (see get_cache).
+    """
+
+    def __init__(self, site, cache=None, timeout=300, max_entries=1000):
+        self.site = site
+        self.timeout = timeout
+        self.cache = get_cache(cache, timeout, max_entries)
+
+    def _generation_key(self, path):
+        digest = hashlib.md5(force_bytes(path.rstrip('/'))).hexdigest()
+        return 'filebrowser:listing-generation:%s:%s' % (self.site.name, digest)
+
+    def _key(self, path, mtime):
+        digest = hashlib.md5(force_bytes(path.rstrip('/'))).hexdigest()
+        generation = get_generation(self.cache, self._generation_key(path), self.timeout)
+        return 'filebrowser:listing:%s:%s:%r:%s' % (self.site.name, digest, mtime, generation)
+
+    def get(self, path):
+        """
+        Cached entries for path (or None), with the key as second value:
+        entries listed after a miss are stored with set(key, entries), so
+        they are not found anymore if invalidate has been called meanwhile.
+        """
+        key = self._key(path, get_directory_mtime(self.site.storage, path))
+        return self.cache.get(key), key
+
+    def set(self, key, entries):
+        self.cache.set(key, list(entries), self.timeout)
+
+    def invalidate(self, path):
+        "Remove the cached entries of the directory path (with any modification time)"
+        self.cache.delete(self._generation_key(path))
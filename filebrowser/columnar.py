@@ -0,0 +1,160 @@
+# coding: utf-8
+
+# PYTHON IMPORTS
+import os
+import time
+import calendar
+
+# NumPy is optional (see COLUMNAR_LISTING_THRESHOLD)
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# FILEBROWSER IMPORTS
+from filebrowser.base import EXTENSION_FILETYPES
+
+# FileObject attributes and the respective columns (see ColumnarListing.sort)
+SORTING_COLUMNS = {
+    'date': 'mtime',
+    'filesize': 'size',
+    'filename': 'names',
+    'filename_lower': 'names_lower',
+    'path': 'names',
+    'filetype': 'filetypes',
+}
+
+
+class FileObjectSequence(object):
+    """
+    A sequence of FileObjects for rows of a ColumnarListing.
+    FileObjects are only created when accessed (e.g. for the current page with a Paginator).
+    """
+
+    def __init__(self, listing, rows):
+        self.listing = listing
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.listing.fileobject(row) for row in self.rows[index]]
+        return self.listing.fileobject(self.rows[index])
+
+    def __iter__(self):
+        for row in self.rows:
+            yield self.listing.fileobject(row)
+
+
+class ColumnarListing(object):
+    """
+    The entries of a FileListing (see FileListing.scandir) as parallel NumPy
+    arrays (names, sizes, mtimes and filetypes), for very large directories.
+
+    The type/date/search filters of browse are boolean masks and sorting
+    uses a stable argsort, with the same results as filtering and sorting
+    FileObjects. FileObjects are only created for the rows actually used.
+
+    An example::
+
+        from filebrowser.columnar import ColumnarListing
+        listing = ColumnarListing.for_filelisting(filelisting, threshold=10000)
+        if listing is not None:
+            files = listing.files(filter_type='Image', filter_date='thisyear')
+            first_page = files[:50]
+    """
+
+    def __init__(self, filelisting, entries):
+        self.filelisting = filelisting
+        if filelisting.filter_name_func:
+            entries = [entry for entry in entries if filelisting.filter_name_func(entry[0])]
+        self.entries = entries
+        self.names = numpy.array([entry[0] for entry in entries], dtype='U')
+        self.names_lower = numpy.array([entry[0].lower() for entry in entries], dtype='U')
+        self.is_dir = numpy.array([bool(entry[1]) for entry in entries], dtype=bool)
+        self.size = numpy.array([entry[2] for entry in entries], dtype=numpy.float64)
+        self.mtime = numpy.array([entry[3] for entry in entries], dtype=numpy.float64)
+        self.filetypes = numpy.array(
+            [entry[1] and 'Folder' or EXTENSION_FILETYPES.get(os.path.splitext(entry[0])[1].lower(), '') for entry in entries],
+            dtype='U')
+
+    @classmethod
+    def for_filelisting(cls, filelisting, threshold):
+        """
+        ColumnarListing for filelisting, if NumPy is installed, the listing has
+        at least threshold entries and FileListing's filters/sorting are supported
+        (otherwise None).
+        """
+        if numpy is None or threshold is None or filelisting.filter_func:
+            return None
+        if filelisting.sorting_by and filelisting.sorting_by not in SORTING_COLUMNS:
+            return None
+        if getattr(filelisting, 'metadata_index', None) is not None:
+            return None
+        if not filelisting.is_folder:
+            return None
+        entries = filelisting.listing_entries()
+        if len(entries) < threshold:
+            return None
+        return cls(filelisting, entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def fileobject(self, row):
+        "FileObject for a row (with the metadata of the listing)"
+        name, is_dir, size, mtime = self.entries[row][:4]
+        return self.filelisting._fileobject(os.path.join(self.filelisting.path, name), is_dir, size, mtime)
+
+    # FILTERS
+    # date_mask
+    # filter
+    # sort
+
+    def date_mask(self, filter_date):
+        "Boolean mask of the rows matching filter_date (see sites.get_filterdate)"
+        # FileObjects without a date are treated as 0 (like with browse)
+        dates = numpy.where(numpy.isnan(self.mtime), 0, self.mtime)
+        now = time.time()
+        today = time.localtime()
+        if filter_date == 'today':
+            # the (UTC) day of the file equals the local day
+            day = calendar.timegm((today[0], today[1], today[2], 0, 0, 0)) // 86400
+            return numpy.floor(dates / 86400) == day
+        elif filter_date == 'thismonth':
+            return dates >= now - 2592000
+        elif filter_date == 'thisyear':
+            return (dates >= calendar.timegm((today[0], 1, 1, 0, 0, 0))) & (dates < calendar.timegm((today[0] + 1, 1, 1, 0, 0, 0)))
+        elif filter_date == 'past7days':
+            return dates >= now - 604800
+        elif filter_date == '':
+            return numpy.ones(len(self), dtype=bool)
+        return numpy.zeros(len(self), dtype=bool)
+
+    def filter(self, filter_type=None, filter_date=None, search_re=None):
+        "Rows (in listing order) matching the type/date filters and the search (on lowercase filenames)"
+        mask = numpy.ones(len(self), dtype=bool)
+        if filter_type:
+            mask &= self.filetypes == filter_type
+        if filter_date:
+            mask &= self.date_mask(filter_date)
+        if search_re is not None:
+            mask &= numpy.array([bool(search_re.search(name)) for name in self.names_lower], dtype=bool)
+        return numpy.flatnonzero(mask)
+
+    def sort(self, rows):
+        "Sort rows according to sorting_by and sorting_order of the FileListing"
+        sorting_by = self.filelisting.sorting_by
+        if sorting_by:
+            column = getattr(self, SORTING_COLUMNS[sorting_by])[rows]
+            # stable like sorted() (and reversed afterwards, like FileListing.sort_by_attr)
+            rows = rows[numpy.argsort(column, kind='mergesort')]
+        if self.filelisting.sorting_order == 'desc':
+            rows = rows[::-1]
+        return rows
+
+    def files(self, filter_type=None, filter_date=None, search_re=None):
+        "Filtered and sorted FileObjects (a FileObjectSequence)"
+        return FileObjectSequence(self, self.sort(self.filter(filter_type, filter_date, search_re)))
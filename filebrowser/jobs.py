@@ -0,0 +1,225 @@
+# coding: utf-8
+
+# PYTHON IMPORTS
+import os
+import time
+from contextlib import contextmanager
+
+# FILEBROWSER IMPORTS
+from filebrowser.settings import VERSIONS
+from filebrowser.base import FileObject
+from filebrowser.metadata import SQLiteFile, _like_prefix
+from filebrowser import signals
+
+
+class VersionJobQueue(SQLiteFile):
+    """
+    A durable queue of versions to be generated for a FileBrowserSite,
+    saved with a local SQLite file (and processed with fb_worker).
+
+    A job is one version (path and suffix) of an image. A worker claims all
+    jobs of an image which are due and generates them with a single decode
+    (see FileObject.versions_generate). Failed jobs are retried after
+    retry_delay seconds (doubled with every attempt) and marked as failed
+    after max_attempts. Jobs of workers which have been killed are claimed
+    again after lock_timeout seconds.
+
+    Queueing a version which is already pending does nothing. A version
+    which is being generated is queued again (the original might have
+    changed meanwhile).
+
+    An example::
+
+        from filebrowser.jobs import VersionJobQueue
+        queue = VersionJobQueue(site, '/var/cache/filebrowser/jobs/filebrowser.sqlite3')
+        queue.enqueue('uploads/testimage.jpg', ['thumbnail', 'medium'])
+        while queue.run_job() is not None:
+            pass
+    """
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS fb_jobs ('
+        'path TEXT NOT NULL, suffix TEXT NOT NULL, state TEXT NOT NULL, attempts INTEGER NOT NULL, '
+        'available REAL NOT NULL, started REAL, queued INTEGER NOT NULL, error TEXT, '
+        'PRIMARY KEY (path, suffix))',
+        'CREATE INDEX IF NOT EXISTS fb_jobs_state_available ON fb_jobs (state, available)',
+    )
+    ISOLATION_LEVEL = None
+
+    # Jobs which may be claimed (pending and due, or claimed by a worker which has been killed)
+    CLAIMABLE = "((state = 'pending' AND available <= ?) OR (state = 'running' AND started < ?))"
+
+    def __init__(self, site, filename, max_attempts=3, retry_delay=60, lock_timeout=600):
+        super(VersionJobQueue, self).__init__(site, filename)
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lock_timeout = lock_timeout
+
+    @contextmanager
+    def transaction(self):
+        "A transaction holding the write lock of the queue (from the start)"
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    # QUEUE METHODS
+    # enqueue
+    # claim
+    # complete
+    # fail
+    # remove
+
+    def enqueue(self, path, version_suffixes, retry=True):
+        """
+        Queue versions of the image path. Failed jobs are only
+        queued again with retry.
+        """
+        now = time.time()
+        with self.transaction() as connection:
+            for version_suffix in version_suffixes:
+                connection.execute(
+                    "UPDATE fb_jobs SET state = 'pending', attempts = 0, available = ?, queued = queued + 1, error = NULL "
+                    "WHERE path = ? AND suffix = ? AND (state = 'running' OR (state = 'failed' AND ?))",
+                    (now, path, version_suffix, bool(retry)))
+                connection.execute(
+                    "INSERT OR IGNORE INTO fb_jobs (path, suffix, state, attempts, available, queued) "
+                    "VALUES (?, ?, 'pending', 0, ?, 0)", (path, version_suffix, now))
+
+    def claim(self):
+        """
+        Claim the jobs of the image which is due first. Returns (path, jobs)
+        with jobs as a list of (suffix, queued, attempts), None without any job.
+        """
+        now = time.time()
+        params = (now, now - self.lock_timeout)
+        with self.transaction() as connection:
+            row = connection.execute(
+                'SELECT path FROM fb_jobs WHERE %s ORDER BY available LIMIT 1' % self.CLAIMABLE, params).fetchone()
+            if row is None:
+                return None
+            path = row[0]
+            where = 'path = ? AND %s' % self.CLAIMABLE
+            connection.execute(
+                "UPDATE fb_jobs SET state = 'running', started = ?, attempts = attempts + 1 WHERE %s" % where,
+                (now, path) + params)
+            jobs = connection.execute(
+                "SELECT suffix, queued, attempts FROM fb_jobs WHERE path = ? AND state = 'running' AND started = ?",
+                (path, now)).fetchall()
+        return path, jobs
+
+    def complete(self, path, jobs):
+        "Remove claimed jobs (unless they have been queued again meanwhile)"
+        with self.transaction() as connection:
+            connection.executemany(
+                'DELETE FROM fb_jobs WHERE path = ? AND suffix = ? AND queued = ?',
+                [(path, suffix, queued) for suffix, queued, attempts in jobs])
+
+    def fail(self, path, jobs, error):
+        "Retry claimed jobs later (or mark them as failed after max_attempts)"
+        now = time.time()
+        with self.transaction() as connection:
+            for suffix, queued, attempts in jobs:
+                if attempts >= self.max_attempts:
+                    state, available = 'failed', now
+                else:
+                    state, available = 'pending', now + self.retry_delay * 2 ** (attempts - 1)
+                connection.execute(
+                    "UPDATE fb_jobs SET state = ?, available = ?, error = ? "
+                    "WHERE path = ? AND suffix = ? AND queued = ? AND state = 'running'",
+                    (state, available, error, path, suffix, queued))
+
+    def remove(self, path):
+        "Remove the jobs of an image (or of all images within a folder)"
+        path = path.rstrip('/')
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM fb_jobs WHERE path = ? OR path LIKE ? ESCAPE '!'", (path, _like_prefix(path)))
+
+    # WORKER METHODS
+    # run_job
+
+    def run_job(self):
+        """
+        Claim and generate the versions of one image. Returns the path
+        of the image (None without any job due).
+        """
+        claimed = self.claim()
+        if claimed is None:
+            return None
+        path, jobs = claimed
+        fileobject = FileObject(path, site=self.site)
+        try:
+            # images deleted meanwhile are done
+            if fileobject.exists:
+                fileobject.versions_generate([suffix for suffix, queued, attempts in jobs if suffix in VERSIONS])
+        except Exception as e:
+            self.fail(path, jobs, '%s: %s' % (e.__class__.__name__, e))
+        else:
+            self.complete(path, jobs)
+        return path
+
+    # STATUS METHODS
+    # status
+    # failed
+    # retry_failed
+
+    def status(self):
+        "Number of jobs per state (pending, running and failed)"
+        counts = dict((state, 0) for state in ('pending', 'running', 'failed'))
+        counts.update(self.connection.execute('SELECT state, COUNT(*) FROM fb_jobs GROUP BY state').fetchall())
+        return counts
+
+    def failed(self, limit=None):
+        "Failed jobs as a list of (path, suffix, attempts, error)"
+        query = "SELECT path, suffix, attempts, error FROM fb_jobs WHERE state = 'failed' ORDER BY path, suffix"
+        if limit:
+            query += ' LIMIT %d' % limit
+        return self.connection.execute(query).fetchall()
+
+    def retry_failed(self):
+        "Queue all failed jobs again. Returns the number of jobs."
+        with self.transaction() as connection:
+            return connection.execute(
+                "UPDATE fb_jobs SET state = 'pending', attempts = 0, available = ?, queued = queued + 1 "
+                "WHERE state = 'failed'", (time.time(), )).rowcount
+
+
+def _version_queue(site):
+    return getattr(site, 'version_queue', None)
+
+
+def _enqueue_image(site, fileobject):
+    if fileobject.filetype == 'Image':
+        site.version_queue.enqueue(fileobject.path, sorted(VERSIONS))
+
+
+def on_post_upload(sender, path, file, site, **kwargs):
+    if _version_queue(site) is not None:
+        _enqueue_image(site, file)
+
+
+def on_post_delete(sender, path, name, site, **kwargs):
+    if _version_queue(site) is not None:
+        site.version_queue.remove(path)
+
+
+def on_post_rename(sender, path, name, new_name, site, **kwargs):
+    if _version_queue(site) is not None:
+        site.version_queue.remove(path)
+        _enqueue_image(site, FileObject(os.path.join(os.path.dirname(path), new_name), site=site))
+
+
+def on_actions_post_apply(sender, action_name, fileobject, result, site, **kwargs):
+    if _version_queue(site) is not None:
+        for item in fileobject:
+            _enqueue_image(site, item)
+
+
+signals.filebrowser_post_upload.connect(on_post_upload)
+signals.filebrowser_post_delete.connect(on_post_delete)
+signals.filebrowser_post_rename.connect(on_post_rename)
+signals.filebrowser_actions_post_apply.connect(on_actions_post_apply)
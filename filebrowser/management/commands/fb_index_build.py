@@ -0,0 +1,39 @@
+# coding: utf-8
+
+# PYTHON IMPORTS
+from optparse import make_option
+
+# DJANGO IMPORTS
+from django.core.management.base import BaseCommand, CommandError
+
+# FILEBROWSER IMPORTS
+from filebrowser.sites import get_site_dict
+
+
+class Command(BaseCommand):
+    args = '<site_name site_name ...>'
+    help = "Build/Update the metadata index of FileBrowser sites (all sites with an index by default)."
+    option_list = BaseCommand.option_list + (
+        make_option('--dimensions', action='store_true', dest='dimensions', default=False,
+            help='Read the dimensions of all new or changed images.'),
+    )
+
+    def handle(self, *args, **options):
+        sites = get_site_dict()
+        if args:
+            for name in args:
+                if name not in sites:
+                    raise CommandError('"%s" is no deployed FileBrowser site.' % name)
+                if sites[name].metadata_index is None:
+                    raise CommandError('The site "%s" has no metadata index (see FILEBROWSER_METADATA_INDEX_DIR).' % name)
+            names = args
+        else:
+            names = [name for name, site in sites.items() if site.metadata_index is not None]
+            if not names:
+                raise CommandError('No site with a metadata index (see FILEBROWSER_METADATA_INDEX_DIR).')
+
+        for name in names:
+            site = sites[name]
+            self.stdout.write('Indexing site "%s" (%s) ...\n' % (name, site.directory))
+            listed = site.metadata_index.refresh(site.directory, recursive=True, dimensions=options['dimensions'])
+            self.stdout.write('%s directories updated.\n' % listed)
@@ -2,7 +2,6 @@
 
 # PYTHON IMPORTS
 import os
-import re
 
 # DJANGO IMPORTS
 from django.core.management.base import BaseCommand, CommandError
@@ -10,16 +9,12 @@ from django.conf import settings
 from django.utils.six.moves import input
 
 # FILEBROWSER IMPORTS
-from filebrowser.settings import EXTENSION_LIST, EXCLUDE, DIRECTORY, VERSIONS, EXTENSIONS
+from filebrowser.settings import DIRECTORY, VERSIONS, EXTENSIONS
 from filebrowser.base import FileListing, FileObject
+from filebrowser.utils import get_exclude_func
 
 
-filter_re = []
-for exp in EXCLUDE:
-    filter_re.append(re.compile(exp))
-for k, v in VERSIONS.items():
-    exp = (r'_%s(%s)') % (k, '|'.join(EXTENSION_LIST))
-    filter_re.append(re.compile(exp))
+exclude_func = get_exclude_func()
 
 
 class Command(BaseCommand):
@@ -60,16 +55,16 @@ class Command(BaseCommand):
                     continue
 
         # filelisting
-        filelisting = FileListing(path, filter_func=self.filter_images)  # FIXME filterfunc: no hidden files, exclude list, no versions, just images!
-        for fileobject in filelisting.files_walk_filtered():
+        filelisting = FileListing(path, filter_name_func=self.filter_images)  # FIXME filterfunc: no hidden files, exclude list, no versions, just images!
+        for fileobject in filelisting.files_walk_iterator(ordered=False):
             if fileobject.filetype == "Image":
                 if selected_version:
                     self.stdout.write('generating version "%s" for: %s\n' % (selected_version, fileobject.path))
                     versionobject = fileobject.version_generate(selected_version)  # FIXME force?
                 else:
                     self.stdout.write('generating all versions for: %s\n' % fileobject.path)
-                    for version in VERSIONS:
-                        versionobject = fileobject.version_generate(version)  # FIXME force?
+                    # with a single decode of the image
+                    fileobject.versions_generate()  # FIXME force?
 
         # # walkt throu the filebrowser directory
         # # for all/new files (except file versions itself and excludes)
@@ -90,11 +85,5 @@ class Command(BaseCommand):
         #         if extension in EXTENSIONS["Image"]:
         #             self.createVersions(os.path.join(rel_dir, filename), selected_version)
 
-    def filter_images(self, item):
-        filtered = item.filename.startswith('.')
-        for re_prefix in filter_re:
-            if re_prefix.search(item.filename):
-                filtered = True
-        if filtered:
-            return False
-        return True
+    def filter_images(self, name):
+        return not exclude_func(name)
@@ -0,0 +1,68 @@
+# coding: utf-8
+
+# PYTHON IMPORTS
+import os
+from optparse import make_option
+
+# DJANGO IMPORTS
+from django.core.management.base import BaseCommand, CommandError
+
+# FILEBROWSER IMPORTS
+from filebrowser.settings import VERSIONS
+from filebrowser.base import FileListing, VERSION_HASH_RE
+from filebrowser.sites import get_site_dict
+
+
+class Command(BaseCommand):
+    args = '<site_name site_name ...>'
+    help = "Rename existing versions to names with a hash (see FILEBROWSER_VERSION_NAMES_HASHED), for all sites by default."
+    option_list = BaseCommand.option_list + (
+        make_option('--reverse', action='store_true', dest='reverse', default=False,
+            help='Rename versions with a hash to names without a hash.'),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+            help='Only show the versions to be renamed.'),
+    )
+
+    def handle(self, *args, **options):
+        sites = get_site_dict()
+        for name in args:
+            if name not in sites:
+                raise CommandError('"%s" is no deployed FileBrowser site.' % name)
+        names = args or list(sites)
+
+        for name in names:
+            site = sites[name]
+            self.stdout.write('Renaming versions of site "%s" (%s) ...\n' % (name, site.directory))
+            renamed = 0
+            filelisting = FileListing(site.directory, filter_name_func=site.filter_browse, site=site)
+            for fileobject in filelisting.files_walk_iterator(ordered=False):
+                if fileobject.filetype != "Image" or fileobject.is_version:
+                    continue
+                version_dir = os.path.join(fileobject.versions_basedir, fileobject.dirname)
+                for version_suffix in sorted(VERSIONS):
+                    plain_path = os.path.join(version_dir, fileobject._version_name(version_suffix))
+                    hashed_path = os.path.join(version_dir, fileobject._version_name(version_suffix, fileobject.version_hash(version_suffix)))
+                    old_path, new_path = options['reverse'] and (hashed_path, plain_path) or (plain_path, hashed_path)
+                    if not site.storage.isfile(old_path):
+                        continue
+                    # outdated versions are generated again (with their new name)
+                    if not options['reverse'] and site.storage.modified_time(old_path) < site.storage.modified_time(fileobject.path):
+                        self.stdout.write('removing outdated version: %s\n' % old_path)
+                        if not options['dry_run']:
+                            site.storage.delete(old_path)
+                        continue
+                    self.stdout.write('%s -> %s\n' % (old_path, new_path))
+                    if not options['dry_run']:
+                        site.storage.move(old_path, new_path, allow_overwrite=True)
+                    renamed += 1
+                # versions with the hash of an outdated original (or of outdated settings)
+                if not options['reverse']:
+                    current = [os.path.join(version_dir, fileobject.version_name(version_suffix)) for version_suffix in VERSIONS]
+                    for path in fileobject._stored_versions(VERSIONS):
+                        if path not in current and VERSION_HASH_RE.search(os.path.splitext(path)[0]):
+                            self.stdout.write('removing outdated version: %s\n' % path)
+                            if not options['dry_run']:
+                                site.storage.delete(path)
+                if not options['dry_run']:
+                    fileobject._invalidate_versions(VERSIONS)
+            self.stdout.write('%s versions renamed.\n' % renamed)
@@ -11,6 +11,14 @@ from django.utils.six.moves import input
 
 # FILEBROWSER IMPORTS
 from filebrowser.settings import EXTENSION_LIST, EXCLUDE, DIRECTORY, VERSIONS, EXTENSIONS
+from filebrowser.utils import VERSION_HASH_PATTERN
+from filebrowser.base import FileObject
+from filebrowser.sites import get_site_dict
+
+
+def version_suffix_re(version_name):
+    "Matches the suffix of a version (also with a hash, see VERSION_NAMES_HASHED) at the end of a filename root"
+    return re.compile('_%s(?:%s)?$' % (re.escape(version_name), VERSION_HASH_PATTERN))
 
 
 class Command(BaseCommand):
@@ -91,11 +99,33 @@ class Command(BaseCommand):
         if do_remove == "y":
             for current_file in files:
                 os.remove(current_file)
+            self.invalidate_manifests(files, version_name)
             self.stdout.write('%d file(s) removed.\n\n' % len(files))
         else:
             self.stdout.write('No files removed.\n\n')
         return
 
+    # remove the versions from the version manifests of all sites (see VERSION_MANIFEST)
+    def invalidate_manifests(self, files, version_name):
+        suffix_re = version_suffix_re(version_name)
+        for site in get_site_dict().values():
+            if getattr(site, 'version_manifest', None) is None:
+                continue
+            try:
+                location = site.storage.path('')
+            except NotImplementedError:
+                continue
+            for current_file in files:
+                relative_path = os.path.relpath(current_file, location)
+                if relative_path.split(os.sep)[0] == os.pardir:
+                    continue
+                version = FileObject(relative_path.replace(os.sep, '/'), site=site)
+                # like FileObject.original, with the known version suffix
+                original_dir = version.head.replace(version.versions_basedir, "", 1).lstrip("/")
+                original_filename = suffix_re.sub('', version.filename_root) + version.extension
+                original = FileObject(os.path.join(site.directory, original_dir, original_filename), site=site)
+                original._invalidate_versions([version_name])
+
     # get files mathing:
     # path: search recoursive in this path (os.walk)
     # version_name: string is pre/suffix of filename
@@ -106,6 +136,7 @@ class Command(BaseCommand):
         filter_re = []
         for exp in EXCLUDE:
             filter_re.append(re.compile(exp))
+        suffix_re = version_suffix_re(version_name)
 
         # walkt throu the filebrowser directory
         # for all/new files (except file versions itself and excludes)
@@ -128,7 +159,7 @@ class Command(BaseCommand):
                     if search_for_prefix:
                         if filename_noext.startswith(version_name + "_"):
                             file_list.append(os.path.join(dirpath, filename))
-                    elif filename_noext.endswith("_" + version_name):
+                    elif suffix_re.search(filename_noext):
                         file_list.append(os.path.join(dirpath, filename))
 
         return file_list
@@ -0,0 +1,87 @@
+# coding: utf-8
+
+# PYTHON IMPORTS
+import time
+from multiprocessing import Pool
+from optparse import make_option
+
+# DJANGO IMPORTS
+from django.core.management.base import BaseCommand, CommandError
+
+# FILEBROWSER IMPORTS
+from filebrowser.sites import get_site_dict
+
+
+def run_job(name):
+    "Generate the versions of one image queued with the site name (within a worker process)"
+    return get_site_dict()[name].version_queue.run_job()
+
+
+class Command(BaseCommand):
+    args = '<site_name site_name ...>'
+    help = "Generate the versions queued with FileBrowser sites (all sites with a queue by default)."
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', action='store', type='int', dest='workers', default=1,
+            help='Number of worker processes (0 generates versions within this process).'),
+        make_option('--max-tasks-per-child', action='store', type='int', dest='max_tasks_per_child', default=100,
+            help='Replace a worker process after generating the versions of n images (limits the memory used with PIL).'),
+        make_option('--burst', action='store_true', dest='burst', default=False,
+            help='Quit when all queues are empty.'),
+        make_option('--sleep', action='store', type='float', dest='sleep', default=1.0,
+            help='Seconds to wait for new jobs when all queues are empty.'),
+        make_option('--status', action='store_true', dest='status', default=False,
+            help='Show the number of pending, running and failed jobs (and the failed jobs).'),
+        make_option('--retry-failed', action='store_true', dest='retry_failed', default=False,
+            help='Queue all failed jobs again.'),
+    )
+
+    def handle(self, *args, **options):
+        sites = get_site_dict()
+        if args:
+            for name in args:
+                if name not in sites:
+                    raise CommandError('"%s" is no deployed FileBrowser site.' % name)
+                if sites[name].version_queue is None:
+                    raise CommandError('The site "%s" has no version queue (see FILEBROWSER_VERSION_QUEUE_DIR).' % name)
+            names = args
+        else:
+            names = [name for name, site in sites.items() if site.version_queue is not None]
+            if not names:
+                raise CommandError('No site with a version queue (see FILEBROWSER_VERSION_QUEUE_DIR).')
+
+        if options['status'] or options['retry_failed']:
+            for name in names:
+                version_queue = sites[name].version_queue
+                if options['retry_failed']:
+                    self.stdout.write('%s failed jobs of site "%s" queued again.\n' % (version_queue.retry_failed(), name))
+                if options['status']:
+                    status = version_queue.status()
+                    self.stdout.write('Site "%s": %s pending, %s running, %s failed\n' % (name, status['pending'], status['running'], status['failed']))
+                    for path, suffix, attempts, error in version_queue.failed():
+                        self.stdout.write(' * %s (%s, %s attempts): %s\n' % (path, suffix, attempts, error))
+            return
+
+        workers = options['workers']
+        pool = None
+        if workers > 0:
+            pool = Pool(workers, maxtasksperchild=options['max_tasks_per_child'] or None)
+        try:
+            while True:
+                if pool is None:
+                    paths = [run_job(name) for name in names]
+                else:
+                    # one job per worker and site at a time
+                    results = [pool.apply_async(run_job, (name, )) for name in names for i in range(workers)]
+                    paths = [result.get() for result in results]
+                paths = [path for path in paths if path is not None]
+                for path in paths:
+                    if int(options['verbosity']) > 1:
+                        self.stdout.write('generated versions for: %s\n' % path)
+                if not paths:
+                    if options['burst']:
+                        break
+                    time.sleep(options['sleep'])
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
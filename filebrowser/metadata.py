@@ -0,0 +1,315 @@
+# coding: utf-8
+
+# PYTHON IMPORTS
+import os
+import time
+import sqlite3
+import threading
+
+# FILEBROWSER IMPORTS
+from filebrowser.base import FileObject
+from filebrowser import signals
+from filebrowser.utils import get_directory_mtime
+
+
+def _like_prefix(path):
+    "LIKE pattern (with ESCAPE '!') for all paths within the folder path"
+    return path.replace('!', '!!').replace('%', '!%').replace('_', '!_') + '/%'
+
+
+class SQLiteFile(object):
+    "A local SQLite file of a FileBrowserSite (created with SCHEMA)"
+
+    SCHEMA = ()
+    # None for autocommit (with transactions started explicitly)
+    ISOLATION_LEVEL = ''
+
+    def __init__(self, site, filename):
+        self.site = site
+        self.filename = filename
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        "SQLite connection (one per thread and process)"
+        connection = getattr(self._local, 'connection', None)
+        # a connection must not be used with a forked process
+        if connection is None or self._local.pid != os.getpid():
+            dirname = os.path.dirname(self.filename)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            connection = sqlite3.connect(self.filename, timeout=30, isolation_level=self.ISOLATION_LEVEL)
+            with connection:
+                for statement in self.SCHEMA:
+                    connection.execute(statement)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+
+class MetadataIndex(SQLiteFile):
+    """
+    A persistent index of the storage metadata of a FileBrowserSite, saved
+    with a local SQLite file.
+
+    For each file/folder, the index holds path, parent, filetype, size,
+    mtime, image width/height and whether the file is a version. A
+    directory is listed again (with storage.scandir) only if its
+    modification time has changed. Entries are filtered by SQLite (with
+    filter_name_func of a FileListing). A FileListing sorts them itself
+    (see FileListing.sort), entries are only sorted by SQLite with
+    sorting_by.
+
+    An example::
+
+        from filebrowser.metadata import MetadataIndex
+        index = MetadataIndex(site, '/var/cache/filebrowser/filebrowser.sqlite3')
+        index.refresh(site.directory, recursive=True)
+        for name, is_dir, size, mtime, width, height in index.entries(site.directory, sorting_by='date', versions=False):
+            print(name)
+    """
+
+    # FileObject attributes and their respective columns
+    SORTING_COLUMNS = {
+        'date': 'mtime',
+        'filesize': 'size',
+        'filename': 'name',
+        'filename_lower': 'name_lower',
+        'filetype': 'filetype',
+        'path': 'path',
+    }
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS fb_entries ('
+        'path TEXT PRIMARY KEY, parent TEXT NOT NULL, name TEXT NOT NULL, name_lower TEXT NOT NULL, '
+        'filetype TEXT, is_folder INTEGER NOT NULL, size INTEGER, mtime REAL, '
+        'width INTEGER, height INTEGER, is_version INTEGER NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS fb_entries_parent_mtime ON fb_entries (parent, mtime)',
+        'CREATE INDEX IF NOT EXISTS fb_entries_parent_size ON fb_entries (parent, size)',
+        'CREATE INDEX IF NOT EXISTS fb_entries_parent_name ON fb_entries (parent, name_lower)',
+        'CREATE TABLE IF NOT EXISTS fb_directories (path TEXT PRIMARY KEY, mtime REAL)',
+    )
+
+    def _normalize(self, path):
+        return path.rstrip('/')
+
+    def _scandir(self, path):
+        if hasattr(self.site.storage, 'scandir'):
+            try:
+                return self.site.storage.scandir(path)
+            except NotImplementedError:
+                pass
+        dirs, files = self.site.storage.listdir(path)
+        return [(d, True, None, None) for d in dirs] + [(f, False, None, None) for f in files]
+
+    # REFRESH METHODS
+    # refresh(path)
+    # invalidate(path)
+
+    def refresh(self, path, recursive=False, dimensions=False):
+        """
+        Update the index for a directory, if its modification time has changed.
+
+        With recursive=True, all subdirectories are updated as well.
+        With dimensions=True, the dimensions of new or changed images are
+        read (otherwise, they are stored once retrieved with a FileObject).
+        Returns the number of directories which have been listed again.
+        """
+        listed = 0
+        pending = [self._normalize(path)]
+        while pending:
+            current = pending.pop()
+            if self._refresh_directory(current, dimensions):
+                listed += 1
+            if recursive:
+                pending.extend(row[0] for row in self.connection.execute(
+                    'SELECT path FROM fb_entries WHERE parent = ? AND is_folder = 1', (current, )))
+        return listed
+
+    def _refresh_directory(self, path, dimensions):
+        connection = self.connection
+        mtime = get_directory_mtime(self.site.storage, path)
+        row = connection.execute('SELECT mtime FROM fb_directories WHERE path = ?', (path, )).fetchone()
+        if row is not None and mtime is not None and row[0] == mtime:
+            if dimensions:
+                self._read_dimensions(path)
+            return False
+
+        existing = {}
+        for name, is_folder, size, entry_mtime, width, height in connection.execute(
+                'SELECT name, is_folder, size, mtime, width, height FROM fb_entries WHERE parent = ?', (path, )):
+            existing[name] = (is_folder, size, entry_mtime, width, height)
+
+        rows = []
+        for name, is_dir, size, entry_mtime in self._scandir(path):
+            fileobject = FileObject(os.path.join(path, name), site=self.site)
+            fileobject._is_folder_stored = is_dir
+            width = height = None
+            if fileobject.filetype == 'Image':
+                previous = existing.get(name)
+                if previous is not None and previous[1:3] == (size, entry_mtime):
+                    width, height = previous[3:5]
+                elif dimensions and fileobject.dimensions:
+                    width, height = fileobject.dimensions
+            # versions are images (also excluded with the browse filter, see get_exclude_func)
+            is_version = fileobject.filetype == 'Image' and fileobject.is_version
+            rows.append((fileobject.path, path, name, name.lower(), fileobject.filetype, int(is_dir), size, entry_mtime, width, height, int(is_version)))
+            existing.pop(name, None)
+
+        with connection:
+            connection.execute('DELETE FROM fb_entries WHERE parent = ?', (path, ))
+            # remove folders which do not exist anymore (including their contents)
+            for name, (is_folder, size, entry_mtime, width, height) in existing.items():
+                if is_folder:
+                    self._delete_tree(os.path.join(path, name))
+            connection.executemany('INSERT OR REPLACE INTO fb_entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            connection.execute('INSERT OR REPLACE INTO fb_directories VALUES (?, ?)', (path, mtime))
+        return True
+
+    def _read_dimensions(self, path):
+        "Read the missing dimensions of the images within a directory"
+        for entry_path, in self.connection.execute(
+                "SELECT path FROM fb_entries WHERE parent = ? AND filetype = 'Image' AND width IS NULL", (path, )).fetchall():
+            fileobject = FileObject(entry_path, site=self.site)
+            if fileobject.dimensions:
+                self.set_dimensions(entry_path, fileobject.dimensions)
+
+    def _delete_tree(self, path):
+        pattern = _like_prefix(path)
+        self.connection.execute("DELETE FROM fb_entries WHERE path = ? OR path LIKE ? ESCAPE '!'", (path, pattern))
+        self.connection.execute("DELETE FROM fb_directories WHERE path = ? OR path LIKE ? ESCAPE '!'", (path, pattern))
+
+    def invalidate(self, path):
+        "Make sure the directory is listed again with the next refresh"
+        with self.connection:
+            self.connection.execute('DELETE FROM fb_directories WHERE path = ?', (self._normalize(path), ))
+
+    def set_dimensions(self, path, dimensions):
+        "Store the dimensions of an image"
+        with self.connection:
+            self.connection.execute('UPDATE fb_entries SET width = ?, height = ? WHERE path = ?', (dimensions[0], dimensions[1], path))
+
+    # QUERY METHODS
+    # entries(path)
+    # count(path)
+
+    def _where(self, path, filter_name_func, versions):
+        where, params = 'parent = ?', [self._normalize(path)]
+        if not versions:
+            where += ' AND is_version = 0'
+        if filter_name_func is not None:
+            # called by SQLite, so that count does not need to fetch the names
+            self.connection.create_function('fb_filter_name', 1, lambda name: bool(filter_name_func(name)))
+            where += ' AND fb_filter_name(name)'
+        return where, params
+
+    def entries(self, path, sorting_by=None, sorting_order=None, filter_name_func=None, versions=True):
+        """
+        (name, is_dir, size, mtime, width, height) for the contents of a directory.
+
+        Sorted with the database if sorting_by is in SORTING_COLUMNS
+        (descending with sorting_order="desc"), optionally filtered with
+        filter_name_func (name -> True, if the item is included).
+        Versions are left out with versions=False.
+        """
+        where, params = self._where(path, filter_name_func, versions)
+        query = 'SELECT name, is_folder, size, mtime, width, height FROM fb_entries WHERE %s' % where
+        if sorting_by in self.SORTING_COLUMNS:
+            query += ' ORDER BY %s %s' % (self.SORTING_COLUMNS[sorting_by], sorting_order == 'desc' and 'DESC' or 'ASC')
+        else:
+            # same order as the listing of the storage (folders first)
+            query += ' ORDER BY rowid'
+        return [(name, bool(is_folder), size, mtime, width, height) for name, is_folder, size, mtime, width, height in self.connection.execute(query, params)]
+
+    def count(self, path, filter_name_func=None, versions=True):
+        "Number of files/folders within a directory, optionally filtered with filter_name_func (and without versions)"
+        where, params = self._where(path, filter_name_func, versions)
+        return self.connection.execute('SELECT COUNT(*) FROM fb_entries WHERE %s' % where, params).fetchone()[0]
+
+
+class ImageMetadataCache(SQLiteFile):
+    """
+    A persistent cache of image metadata (width, height, format and mode)
+    of a FileBrowserSite, saved with a local SQLite file.
+
+    Entries are keyed on path, size and modification time (in whole
+    seconds) of an image, so only new or changed images are read (see
+    FileObject.dimensions). Stale entries are pruned lazily: entries of
+    changed images are overwritten when the image has been read again,
+    entries of images deleted (or renamed) with FileBrowser are removed
+    with the signals of the site. Images removed otherwise are found with
+    prune, which checks the entries checked least recently (at most
+    prune_limit entries every prune_interval seconds, while new images
+    are stored).
+    """
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS fb_images ('
+        'path TEXT PRIMARY KEY, size INTEGER, mtime REAL, '
+        'width INTEGER, height INTEGER, format TEXT, mode TEXT, checked REAL NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS fb_images_checked ON fb_images (checked)',
+    )
+
+    def __init__(self, site, filename, prune_interval=3600, prune_limit=100):
+        super(ImageMetadataCache, self).__init__(site, filename)
+        self.prune_interval = prune_interval
+        self.prune_limit = prune_limit
+        self._pruned = time.time()
+
+    def get(self, path, size, mtime):
+        "(width, height, format, mode) of an image, None if unknown or stale"
+        row = self.connection.execute('SELECT size, mtime, width, height, format, mode FROM fb_images WHERE path = ?', (path, )).fetchone()
+        if row is None:
+            return None
+        if (row[0], row[1]) != (size, int(mtime)):
+            # overwritten with set (not deleted, another process might still know the previous version)
+            return None
+        return tuple(row[2:])
+
+    def set(self, path, size, mtime, info):
+        "Store (width, height, format, mode) of an image"
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO fb_images VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (path, size, int(mtime)) + tuple(info) + (time.time(), ))
+        if self.prune_interval is not None and self._pruned + self.prune_interval < time.time():
+            self._pruned = time.time()
+            self.prune(self.prune_limit)
+
+    def remove(self, path):
+        "Remove the entries of an image (or of all images within a folder)"
+        path = path.rstrip('/')
+        with self.connection:
+            self.connection.execute("DELETE FROM fb_images WHERE path = ? OR path LIKE ? ESCAPE '!'", (path, _like_prefix(path)))
+
+    def prune(self, limit=None):
+        """
+        Remove the entries of images which do not exist anymore. Checks (at most limit)
+        entries, the ones checked least recently first. Returns the number of removed entries.
+        """
+        query = 'SELECT path FROM fb_images ORDER BY checked'
+        if limit:
+            query += ' LIMIT %d' % limit
+        paths = [row[0] for row in self.connection.execute(query).fetchall()]
+        missing = [path for path in paths if not self.site.storage.exists(path)]
+        now = time.time()
+        with self.connection:
+            self.connection.executemany('DELETE FROM fb_images WHERE path = ?', [(path, ) for path in missing])
+            self.connection.executemany('UPDATE fb_images SET checked = ? WHERE path = ?', [(now, path) for path in paths])
+        return len(missing)
+
+
+def _image_metadata(site):
+    return getattr(site, 'image_metadata', None)
+
+
+def on_post_delete(sender, path, name, site, **kwargs):
+    if _image_metadata(site) is not None:
+        site.image_metadata.remove(path)
+
+
+def on_post_rename(sender, path, name, new_name, site, **kwargs):
+    if _image_metadata(site) is not None:
+        site.image_metadata.remove(path)
+
+
+signals.filebrowser_post_delete.connect(on_post_delete)
+signals.filebrowser_post_rename.connect(on_post_rename)
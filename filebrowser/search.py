@@ -0,0 +1,261 @@
+# coding: utf-8
+
+# PYTHON IMPORTS
+import os
+import re
+import time
+import bisect
+import threading
+
+# FILEBROWSER IMPORTS
+from filebrowser.base import FileListing, FileObject
+from filebrowser.utils import get_directory_mtime
+from filebrowser import signals
+
+# Characters with a special meaning within a regular expression
+REGEX_SPECIAL = set('.^$*+?{}[]\\|()')
+
+
+def trigrams(value):
+    "Set of all trigrams of value"
+    return set(value[i:i + 3] for i in range(len(value) - 2))
+
+
+class TrigramIndex(object):
+    """
+    An in-memory trigram index of the filenames of a FileBrowserSite
+    (for searches with SEARCH_TRAVERSE).
+
+    The index holds the paths (relative to site.directory) of all items
+    passing site.filter_browse. It is built with a walk of site.directory
+    when used first and updated with the signals for uploads, new folders,
+    renames and deletions (of this process).
+
+    Changes of other processes are found with the modification times of
+    all directories, checked every check_interval seconds (changes of this
+    process modify them as well, the stored times are not updated in order
+    not to miss a change of another process). The index is then rebuilt in
+    a background thread (also after timeout seconds), the previous index is
+    used until the new one is complete.
+
+    Literal queries (at least 3 characters) only check the items with all
+    trigrams of the query, other queries check all filenames of the index.
+    """
+
+    def __init__(self, site, timeout=3600, check_interval=10):
+        self.site = site
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self._lock = threading.RLock()
+        self._built = None
+        self._checked = None
+        self._paths = []
+        self._trigrams = {}
+        # modification times of all directories (storage paths)
+        self._directories = {}
+        # background rebuild (and the updates to be applied to its result)
+        self._thread = None
+        self._pending = None
+
+    def _filename(self, path):
+        return os.path.basename(path).lower()
+
+    def _prefix(self, path):
+        path = path.strip('/')
+        return path and path + '/' or ''
+
+    def _range(self, prefix):
+        "Start and end of the items within _paths starting with prefix"
+        start = bisect.bisect_left(self._paths, prefix)
+        # all paths with prefix sort before prefix + a character greater than any other
+        end = bisect.bisect_left(self._paths, prefix + u'\U0010ffff', start) if prefix else len(self._paths)
+        return start, end
+
+    # BUILD/UPDATE METHODS
+    # build
+    # changed
+    # add
+    # remove
+    # move
+
+    def build(self):
+        "(Re)Build the index with a walk of site.directory"
+        filelisting = FileListing(self.site.directory, site=self.site)
+        directories = {}
+        visited = set()
+
+        def listdir(path):
+            # like FileListing._walk (without walking a directory twice), also storing the modification times
+            key = filelisting._directory_key(path)
+            if key in visited:
+                return None
+            visited.add(key)
+            directories[path] = get_directory_mtime(self.site.storage, path)
+            return self.site.storage.listdir(path)
+        paths = []
+        if filelisting.is_folder:
+            paths = sorted(path for path in filelisting._walk(filelisting.path, listdir) if self.site.filter_browse(os.path.basename(path)))
+        index = {}
+        for path in paths:
+            for trigram in trigrams(self._filename(path)):
+                index.setdefault(trigram, set()).add(path)
+        with self._lock:
+            self._paths = paths
+            self._trigrams = index
+            self._directories = directories
+            self._built = self._checked = time.time()
+            # updates made while building
+            pending, self._pending = self._pending, None
+            for method, args in pending or ():
+                method(*args)
+
+    def changed(self):
+        "True, if a directory has been modified since the index has been built (e.g. by another process)"
+        with self._lock:
+            directories = list(self._directories.items())
+        for path, mtime in directories:
+            if get_directory_mtime(self.site.storage, path) != mtime:
+                return True
+        return False
+
+    def _ensure_built(self):
+        if self._built is None:
+            # nothing to be used meanwhile
+            self.build()
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        now = time.time()
+        expired = self.timeout and self._built + self.timeout < now
+        if expired or (self.check_interval is not None and self._checked + self.check_interval < now):
+            self._checked = now
+            self._pending = []
+            self._thread = threading.Thread(target=self._rebuild, args=(not expired, ))
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _rebuild(self, check):
+        "Rebuild the index (only if a directory has been modified with check), within a background thread"
+        try:
+            if not check or self.changed():
+                self.build()
+        finally:
+            with self._lock:
+                self._pending = None
+
+    def add(self, path):
+        "Add an item (path relative to site.directory)"
+        path = path.strip('/')
+        if self._built is None or not self.site.filter_browse(os.path.basename(path)):
+            return
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((self.add, (path, )))
+            position = bisect.bisect_left(self._paths, path)
+            if position < len(self._paths) and self._paths[position] == path:
+                return
+            self._paths.insert(position, path)
+            for trigram in trigrams(self._filename(path)):
+                self._trigrams.setdefault(trigram, set()).add(path)
+
+    def remove(self, path):
+        "Remove an item (path relative to site.directory), including the contents of a folder"
+        path = path.strip('/')
+        if self._built is None:
+            return
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((self.remove, (path, )))
+            start, end = self._range(self._prefix(path))
+            removed = self._paths[start:end]
+            del self._paths[start:end]
+            position = bisect.bisect_left(self._paths, path)
+            if position < len(self._paths) and self._paths[position] == path:
+                removed.append(self._paths.pop(position))
+            for item in removed:
+                for trigram in trigrams(self._filename(item)):
+                    paths = self._trigrams.get(trigram)
+                    if paths is not None:
+                        paths.discard(item)
+                        if not paths:
+                            del self._trigrams[trigram]
+        return removed
+
+    def move(self, path, new_path):
+        "Move an item (path relative to site.directory), including the contents of a folder"
+        path, new_path = path.strip('/'), new_path.strip('/')
+        with self._lock:
+            removed = self.remove(path)
+            for item in removed or ():
+                self.add(new_path + item[len(path):])
+
+    # QUERY METHODS
+    # search
+    # count
+
+    def search(self, path, query):
+        """
+        FileObjects within the folder path (relative to site.directory)
+        with query (a lowercase regular expression) in their filenames.
+        """
+        with self._lock:
+            self._ensure_built()
+            start, end = self._range(self._prefix(path))
+            if len(query) >= 3 and not REGEX_SPECIAL.intersection(query):
+                sets = sorted((self._trigrams.get(trigram, ()) for trigram in trigrams(query)), key=len)
+                if not sets[0]:
+                    return []
+                if len(sets[0]) >= end - start:
+                    # the folder has fewer items than the candidates
+                    candidates = self._paths[start:end]
+                else:
+                    candidates = sets[0].intersection(*sets[1:])
+                prefix = self._prefix(path)
+                matches = sorted(item for item in candidates if item.startswith(prefix) and query in self._filename(item))
+            else:
+                query_re = re.compile(query, re.M)
+                matches = [item for item in self._paths[start:end] if query_re.search(self._filename(item))]
+        return [FileObject(os.path.join(self.site.directory, item), site=self.site) for item in matches]
+
+    def count(self, path):
+        "Number of items within the folder path (relative to site.directory)"
+        with self._lock:
+            self._ensure_built()
+            start, end = self._range(self._prefix(path))
+            return end - start
+
+
+def _search_index(site):
+    return getattr(site, 'search_index', None)
+
+
+def _relative(site, path):
+    "path relative to site.directory"
+    return os.path.relpath(path, site.directory).replace('\\', '/')
+
+
+def on_post_upload(sender, path, file, site, **kwargs):
+    if _search_index(site) is not None:
+        site.search_index.add(file.path_relative_directory)
+
+
+def on_post_createdir(sender, path, name, site, **kwargs):
+    if _search_index(site) is not None:
+        site.search_index.add(_relative(site, path))
+
+
+def on_post_delete(sender, path, name, site, **kwargs):
+    if _search_index(site) is not None:
+        site.search_index.remove(_relative(site, path))
+
+
+def on_post_rename(sender, path, name, new_name, site, **kwargs):
+    if _search_index(site) is not None:
+        relative_path = _relative(site, path)
+        site.search_index.move(relative_path, os.path.join(os.path.dirname(relative_path), new_name))
+
+
+signals.filebrowser_post_upload.connect(on_post_upload)
+signals.filebrowser_post_createdir.connect(on_post_createdir)
+signals.filebrowser_post_delete.connect(on_post_delete)
+signals.filebrowser_post_rename.connect(on_post_rename)
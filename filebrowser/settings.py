@@ -99,6 +99,81 @@ DEFAULT_SORTING_ORDER = getattr(settings, "FILEBROWSER_DEFAULT_SORTING_ORDER", "
 FOLDER_REGEX = getattr(settings, "FILEBROWSER_FOLDER_REGEX", r'^[\w._\ /-]+$')
 # Traverse directories when searching
 SEARCH_TRAVERSE = getattr(settings, "FILEBROWSER_SEARCH_TRAVERSE", False)
+# Show the recursive size (and number of items) of folders with browse.
+SHOW_FOLDER_SIZE = getattr(settings, "FILEBROWSER_SHOW_FOLDER_SIZE", False)
+# Number of directories listed concurrently when walking a path (e.g. with SEARCH_TRAVERSE).
+# Use a value > 1 with high-latency storages (like S3 or NFS).
+WALK_WORKERS = getattr(settings, "FILEBROWSER_WALK_WORKERS", 1)
+# Number of files of the current page (with browse) whose metadata and thumbnails are retrieved concurrently.
+# Use a value > 1 with high-latency storages (like S3 or NFS).
+PREFETCH_WORKERS = getattr(settings, "FILEBROWSER_PREFETCH_WORKERS", 1)
+# Search (with SEARCH_TRAVERSE) with an in-memory trigram index of filenames.
+SEARCH_INDEX = getattr(settings, "FILEBROWSER_SEARCH_INDEX", False)
+# Rebuild the search index after n seconds (in order to find changes made outside of FileBrowser).
+SEARCH_INDEX_TIMEOUT = getattr(settings, "FILEBROWSER_SEARCH_INDEX_TIMEOUT", 3600)
+# Check the modification times of all directories every n seconds (in order to find changes of other processes).
+# Not checked with None.
+SEARCH_INDEX_CHECK_INTERVAL = getattr(settings, "FILEBROWSER_SEARCH_INDEX_CHECK_INTERVAL", 10)
+# Directory for the persistent metadata index of each FileBrowserSite (a SQLite file per site).
+# The index is disabled with None.
+METADATA_INDEX_DIR = getattr(settings, "FILEBROWSER_METADATA_INDEX_DIR", None)
+# Directory for the persistent image metadata cache (dimensions, format and mode) of each FileBrowserSite
+# (a SQLite file per site). The cache is disabled with None.
+IMAGE_METADATA_DIR = getattr(settings, "FILEBROWSER_IMAGE_METADATA_DIR", None)
+# Cache directory listings across requests (keyed on the modification time of the directory).
+LISTING_CACHE = getattr(settings, "FILEBROWSER_LISTING_CACHE", False)
+# Django cache alias for the listing cache (an in-process cache is used with None).
+LISTING_CACHE_ALIAS = getattr(settings, "FILEBROWSER_LISTING_CACHE_ALIAS", None)
+# Timeout (in seconds) of cached listings.
+LISTING_CACHE_TIMEOUT = getattr(settings, "FILEBROWSER_LISTING_CACHE_TIMEOUT", 300)
+# Max. number of cached listings with the in-process cache.
+LISTING_CACHE_MAX_ENTRIES = getattr(settings, "FILEBROWSER_LISTING_CACHE_MAX_ENTRIES", 1000)
+# Filter and sort listings with at least n entries with NumPy arrays (requires NumPy).
+# Disabled with None.
+COLUMNAR_LISTING_THRESHOLD = getattr(settings, "FILEBROWSER_COLUMNAR_LISTING_THRESHOLD", None)
+# Record generated versions (with the modification time of the original), so versions
+# which are up to date are returned without accessing the storage.
+VERSION_MANIFEST = getattr(settings, "FILEBROWSER_VERSION_MANIFEST", False)
+# Django cache alias for the version manifest (an in-process cache is used with None).
+VERSION_MANIFEST_ALIAS = getattr(settings, "FILEBROWSER_VERSION_MANIFEST_ALIAS", None)
+# Timeout (in seconds) of the entries of the version manifest.
+VERSION_MANIFEST_TIMEOUT = getattr(settings, "FILEBROWSER_VERSION_MANIFEST_TIMEOUT", 86400)
+# Scale versions faster (with JPEG DCT scaling and integer reduction), as long as the image stays
+# n times larger than the version (e.g. 2.0 or 3.0, see reducing_gap with PIL). Disabled with None.
+# Can be set per version with 'reducing_gap' (see VERSIONS).
+VERSION_REDUCING_GAP = getattr(settings, "FILEBROWSER_VERSION_REDUCING_GAP", None)
+# Names of versions with a hash of size and modification time of the original and the version settings
+# (e.g. testimage_thumbnail.3f2a9c01b4d7.jpg), so the URL of a version never changes its content.
+VERSION_NAMES_HASHED = getattr(settings, "FILEBROWSER_VERSION_NAMES_HASHED", False)
+# Directory for lock files, so the versions of an image are only generated by one process at a time
+# (with fcntl, also across hosts sharing the directory). Without a directory, versions are only
+# locked within a process.
+VERSION_LOCK_DIR = getattr(settings, "FILEBROWSER_VERSION_LOCK_DIR", None)
+# Max. seconds to wait for another thread/process generating the versions of an image
+# (afterwards, the versions are generated anyway).
+VERSION_LOCK_TIMEOUT = getattr(settings, "FILEBROWSER_VERSION_LOCK_TIMEOUT", 30)
+# Generate missing/outdated versions in the background with the templatetags version and version_object
+# (returning the placeholder or the original until the version has been generated).
+VERSION_GENERATE_ASYNC = getattr(settings, "FILEBROWSER_VERSION_GENERATE_ASYNC", False)
+# Number of threads generating versions in the background (with VERSION_GENERATE_ASYNC).
+VERSION_GENERATE_WORKERS = getattr(settings, "FILEBROWSER_VERSION_GENERATE_WORKERS", 2)
+# Max. number of versions waiting to be generated in the background (others are queued when requested again).
+VERSION_GENERATE_MAX_PENDING = getattr(settings, "FILEBROWSER_VERSION_GENERATE_MAX_PENDING", 1000)
+# Directory for the durable queue of versions to be generated (with the management command fb_worker)
+# of each FileBrowserSite (a SQLite file per site). The queue is disabled with None.
+VERSION_QUEUE_DIR = getattr(settings, "FILEBROWSER_VERSION_QUEUE_DIR", None)
+# Number of attempts to generate a version with fb_worker (before the job is marked as failed).
+VERSION_QUEUE_MAX_ATTEMPTS = getattr(settings, "FILEBROWSER_VERSION_QUEUE_MAX_ATTEMPTS", 3)
+# Delay (in seconds) before a failed job is retried (doubled with every attempt).
+VERSION_QUEUE_RETRY_DELAY = getattr(settings, "FILEBROWSER_VERSION_QUEUE_RETRY_DELAY", 60)
+# Hand off versions returned with the view fb_version_file to the web server,
+# either with 'X-Accel-Redirect' (nginx, with the URL of the version) or 'X-Sendfile' (Apache/lighttpd, with
+# the path of the version, requires a local storage). Versions are returned by Django with None.
+VERSION_FILE_SENDFILE = getattr(settings, "FILEBROWSER_VERSION_FILE_SENDFILE", None)
+# Max. age (in seconds) of versions returned with the view fb_version_file (Cache-Control).
+VERSION_FILE_MAX_AGE = getattr(settings, "FILEBROWSER_VERSION_FILE_MAX_AGE", 3600)
+# Return versions with the view fb_version_file to all users (instead of staff members only).
+VERSION_FILE_PUBLIC = getattr(settings, "FILEBROWSER_VERSION_FILE_PUBLIC", False)
 # Default Upload and Version Permissions
 DEFAULT_PERMISSIONS = getattr(settings, "FILEBROWSER_DEFAULT_PERMISSIONS", 0o755)
 # Overwrite existing files on upload
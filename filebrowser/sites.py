@@ -3,6 +3,7 @@
 # PYTHON IMPORTS
 import os
 import re
+import hashlib
 from time import gmtime
 from time import strftime
 from time import localtime
@@ -11,9 +12,17 @@ from time import time
 # DJANGO IMPORTS
 from django.shortcuts import render_to_response, HttpResponse
 from django.template import RequestContext as Context
-from django.http import HttpResponseRedirect, HttpResponseBadRequest
+from django.http import HttpResponseRedirect, HttpResponseBadRequest, HttpResponseNotModified, Http404
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:
+    # Django < 1.5
+    StreamingHttpResponse = HttpResponse
 from django.contrib.admin.views.decorators import staff_member_required
 from django.views.decorators.cache import never_cache
+from django.views.decorators.http import require_safe
+from django.utils.http import http_date, parse_etags, quote_etag
+from django.utils.encoding import force_bytes
 from django.utils.translation import ugettext as _
 from django import forms
 from django.core.urlresolvers import reverse, get_urlconf, get_resolver
@@ -28,13 +37,23 @@ except ImportError:
 
 # FILEBROWSER IMPORTS
 from filebrowser.settings import STRICT_PIL, DIRECTORY, EXTENSIONS, SELECT_FORMATS, ADMIN_VERSIONS, ADMIN_THUMBNAIL, MAX_UPLOAD_SIZE,\
-    NORMALIZE_FILENAME, CONVERT_FILENAME, SEARCH_TRAVERSE, EXCLUDE, VERSIONS, EXTENSION_LIST, DEFAULT_SORTING_BY, DEFAULT_SORTING_ORDER,\
-    LIST_PER_PAGE, OVERWRITE_EXISTING, DEFAULT_PERMISSIONS
+    NORMALIZE_FILENAME, CONVERT_FILENAME, SEARCH_TRAVERSE, VERSIONS, DEFAULT_SORTING_BY, DEFAULT_SORTING_ORDER,\
+    LIST_PER_PAGE, OVERWRITE_EXISTING, DEFAULT_PERMISSIONS, METADATA_INDEX_DIR, LISTING_CACHE, LISTING_CACHE_ALIAS,\
+    LISTING_CACHE_TIMEOUT, LISTING_CACHE_MAX_ENTRIES, SEARCH_INDEX, SEARCH_INDEX_TIMEOUT, SEARCH_INDEX_CHECK_INTERVAL, COLUMNAR_LISTING_THRESHOLD,\
+    SHOW_FOLDER_SIZE, IMAGE_METADATA_DIR, PREFETCH_WORKERS, VERSION_MANIFEST, VERSION_MANIFEST_ALIAS, VERSION_MANIFEST_TIMEOUT,\
+    VERSION_QUEUE_DIR, VERSION_QUEUE_MAX_ATTEMPTS, VERSION_QUEUE_RETRY_DELAY, VERSION_FILE_SENDFILE, VERSION_FILE_MAX_AGE, VERSION_FILE_PUBLIC
 from filebrowser.templatetags.fb_tags import query_helper
 from filebrowser.base import FileListing, FileObject
+from filebrowser.metadata import MetadataIndex, ImageMetadataCache
+from filebrowser.cache import ListingCache
+from filebrowser.search import TrigramIndex
+from filebrowser.columnar import ColumnarListing
+from filebrowser.versions import VersionManifest
+from filebrowser.jobs import VersionJobQueue
+from filebrowser.aggregates import FolderAggregates
 from filebrowser.decorators import path_exists, file_exists
 from filebrowser.storage import FileSystemStorageMixin, StorageMixin
-from filebrowser.utils import convert_filename
+from filebrowser.utils import convert_filename, get_exclude_func, version_signature
 from filebrowser import signals
 
 # Add some required methods to FileSystemStorage
@@ -156,6 +175,8 @@ def get_settings_var(directory=DIRECTORY):
     settings_var['CONVERT_FILENAME'] = CONVERT_FILENAME
     # Traverse directories when searching
     settings_var['SEARCH_TRAVERSE'] = SEARCH_TRAVERSE
+    # Recursive folder sizes
+    settings_var['SHOW_FOLDER_SIZE'] = SHOW_FOLDER_SIZE
     return settings_var
 
 
@@ -173,6 +194,15 @@ def handle_file_upload(path, file, site):
     return uploadedfile
 
 
+def file_chunks(f):
+    "Chunks of the file f, closed afterwards (also if the response is closed before)"
+    try:
+        for chunk in f.chunks():
+            yield chunk
+    finally:
+        f.close()
+
+
 def filebrowser_view(view):
     "Only let staff browse the files"
     return staff_member_required(never_cache(view))
@@ -196,6 +226,29 @@ class FileBrowserSite(object):
 
         # Per-site settings:
         self.directory = DIRECTORY
+        self.exclude_func = get_exclude_func()
+        self.metadata_index = None
+        if METADATA_INDEX_DIR:
+            self.metadata_index = MetadataIndex(self, os.path.join(METADATA_INDEX_DIR, '%s.sqlite3' % (self.name or self.app_name)))
+        self.image_metadata = None
+        if IMAGE_METADATA_DIR:
+            self.image_metadata = ImageMetadataCache(self, os.path.join(IMAGE_METADATA_DIR, '%s.sqlite3' % (self.name or self.app_name)))
+        self.listing_cache = None
+        if LISTING_CACHE:
+            self.listing_cache = ListingCache(self, LISTING_CACHE_ALIAS, LISTING_CACHE_TIMEOUT, LISTING_CACHE_MAX_ENTRIES)
+        self.folder_aggregates = None
+        if SHOW_FOLDER_SIZE:
+            self.folder_aggregates = FolderAggregates(self, LISTING_CACHE_ALIAS)
+        self.search_index = None
+        if SEARCH_INDEX:
+            self.search_index = TrigramIndex(self, SEARCH_INDEX_TIMEOUT, SEARCH_INDEX_CHECK_INTERVAL)
+        self.version_manifest = None
+        if VERSION_MANIFEST:
+            self.version_manifest = VersionManifest(self, VERSION_MANIFEST_ALIAS, VERSION_MANIFEST_TIMEOUT)
+        self.version_queue = None
+        if VERSION_QUEUE_DIR:
+            self.version_queue = VersionJobQueue(self, os.path.join(VERSION_QUEUE_DIR, '%s.sqlite3' % (self.name or self.app_name)),
+                                                 VERSION_QUEUE_MAX_ATTEMPTS, VERSION_QUEUE_RETRY_DELAY)
 
     def _directory_get(self):
         "Set directory"
@@ -207,6 +260,15 @@ class FileBrowserSite(object):
 
     directory = property(_directory_get, _directory_set)
 
+    def invalidate_listing(self, path):
+        "Invalidate cached listings (and the metadata index) for the directory path"
+        if self.listing_cache is not None:
+            self.listing_cache.invalidate(path)
+        if self.metadata_index is not None:
+            self.metadata_index.invalidate(path)
+        if self.folder_aggregates is not None:
+            self.folder_aggregates.invalidate(path)
+
     def get_urls(self):
         "URLs for a filebrowser.site"
         try:
@@ -226,6 +288,7 @@ class FileBrowserSite(object):
             url(r'^detail/$', file_exists(self, path_exists(self, filebrowser_view(self.detail))), name="fb_detail"),
             url(r'^version/$', file_exists(self, path_exists(self, filebrowser_view(self.version))), name="fb_version"),
             url(r'^upload_file/$', staff_member_required(csrf_exempt(self._upload_file)), name="fb_do_upload"),
+            url(r'^version_file/(?P<version_suffix>[^/]+)/(?P<path>.+)$', self._version_file_view(), name="fb_version_file"),
         )
         return urlpatterns
 
@@ -281,48 +344,23 @@ class FileBrowserSite(object):
         "filebrowser.site URLs"
         return self.get_urls(), self.app_name, self.name
 
-    def browse(self, request):
-        "Browse Files/Directories."
-        filter_re = []
-        for exp in EXCLUDE:
-            filter_re.append(re.compile(exp))
-        for k, v in VERSIONS.items():
-            exp = (r'_%s(%s)$') % (k, '|'.join(EXTENSION_LIST))
-            filter_re.append(re.compile(exp, re.IGNORECASE))
-
-        def filter_browse(item):
-            "Defining a browse filter"
-            filtered = item.filename.startswith('.')
-            for re_prefix in filter_re:
-                if re_prefix.search(item.filename):
-                    filtered = True
-            if filtered:
-                return False
-            return True
-
-        query = request.GET.copy()
-        path = u'%s' % os.path.join(self.directory, query.get('dir', ''))
-
-        filelisting = FileListing(
-            path,
-            filter_func=filter_browse,
-            sorting_by=query.get('o', DEFAULT_SORTING_BY),
-            sorting_order=query.get('ot', DEFAULT_SORTING_ORDER),
-            site=self)
+    def filter_browse(self, name):
+        "Browse filter for filenames (no hidden files, excludes and versions)"
+        return not self.exclude_func(name)
 
+    def _browse_files(self, filelisting, filter_type, filter_date, re_q, query, page_nr):
+        "Filtered and sorted FileObjects for browse"
+        # Filter first, sort afterwards (see below)
         files = []
-        if SEARCH_TRAVERSE and query.get("q"):
-            listing = filelisting.files_walk_filtered()
+        results_total = None
+        if SEARCH_TRAVERSE and re_q is not None and self.search_index is not None:
+            # Matching items from the search index (without a walk)
+            listing = self.search_index.search(query.get('dir', ''), query.get("q").lower())
+            results_total = self.search_index.count(query.get('dir', ''))
+        elif SEARCH_TRAVERSE and re_q is not None:
+            listing = filelisting.files_walk_filtered(sort=False)
         else:
-            listing = filelisting.files_listing_filtered()
-
-        # If we do a search, precompile the search pattern now
-        do_search = query.get("q")
-        if do_search:
-            re_q = re.compile(query.get("q").lower(), re.M)
-
-        filter_type = query.get('filter_type')
-        filter_date = query.get('filter_date')
+            listing = filelisting.files_listing_filtered(sort=False)
 
         for fileobject in listing:
             # date/type filter
@@ -330,22 +368,71 @@ class FileBrowserSite(object):
             if (not filter_type or fileobject.filetype == filter_type) and (not filter_date or get_filterdate(filter_date, fileobject.date or 0)):
                 append = True
             # search
-            if do_search and not re_q.search(fileobject.filename.lower()):
+            if re_q is not None and not re_q.search(fileobject.filename.lower()):
                 append = False
             # append
             if append:
                 files.append(fileobject)
 
-        filelisting.results_total = len(listing)
+        filelisting.results_total = len(listing) if results_total is None else results_total
         filelisting.results_current = len(files)
 
-        p = Paginator(files, LIST_PER_PAGE)
+        # Only the items up to the requested page have to be in order
+        try:
+            return filelisting.sort(files, limit=int(page_nr) * LIST_PER_PAGE)
+        except ValueError:
+            return filelisting.sort(files)
+
+    def browse(self, request):
+        "Browse Files/Directories."
+        query = request.GET.copy()
+        path = u'%s' % os.path.join(self.directory, query.get('dir', ''))
+
+        filter_type = query.get('filter_type')
+        filter_date = query.get('filter_date')
+
+        # Unless we filter by date, storage metadata is only needed for the
+        # current page (with the listing not being sorted by metadata)
+        filelisting = FileListing(
+            path,
+            filter_name_func=self.filter_browse,
+            sorting_by=query.get('o', DEFAULT_SORTING_BY),
+            sorting_order=query.get('ot', DEFAULT_SORTING_ORDER),
+            site=self,
+            lazy=not filter_date)
+
+        # If we do a search, precompile the search pattern now
+        re_q = None
+        if query.get("q"):
+            re_q = re.compile(query.get("q").lower(), re.M)
+
+        # Very large listings are filtered and sorted with NumPy arrays
+        columnar = None
+        if not (SEARCH_TRAVERSE and re_q is not None):
+            columnar = ColumnarListing.for_filelisting(filelisting, COLUMNAR_LISTING_THRESHOLD)
+
         page_nr = request.GET.get('p', '1')
+        if columnar is not None:
+            files = columnar.files(filter_type, filter_date, re_q)
+            filelisting.results_total = len(columnar)
+            filelisting.results_current = len(files)
+        else:
+            files = self._browse_files(filelisting, filter_type, filter_date, re_q, query, page_nr)
+
+        p = Paginator(files, LIST_PER_PAGE)
         try:
             page = p.page(page_nr)
         except (EmptyPage, InvalidPage):
             page = p.page(p.num_pages)
 
+        # Retrieve metadata and thumbnails of the current page concurrently
+        # (instead of one file after another while rendering)
+        if PREFETCH_WORKERS > 1:
+            fields = ['filesize', 'date', 'dimensions']
+            if SHOW_FOLDER_SIZE:
+                fields.append('folder_size')
+            page.object_list = filelisting.prefetch(page.object_list, fields, versions=[ADMIN_THUMBNAIL])
+
         return render_to_response('filebrowser/index.html', {
             'p': p,
             'page': page,
@@ -371,6 +458,7 @@ class FileBrowserSite(object):
                 try:
                     signals.filebrowser_pre_createdir.send(sender=request, path=server_path, name=form.cleaned_data['name'], site=self)
                     self.storage.makedirs(server_path)
+                    self.invalidate_listing(path)
                     signals.filebrowser_post_createdir.send(sender=request, path=server_path, name=form.cleaned_data['name'], site=self)
                     messages.add_message(request, messages.SUCCESS, _('The Folder %s was successfully created.') % form.cleaned_data['name'])
                     redirect_url = reverse("filebrowser:fb_browse", current_app=self.name) + query_helper(query, "ot=desc,o=date", "ot,o,filter_type,filter_date,q,p")
@@ -412,18 +500,16 @@ class FileBrowserSite(object):
         query = request.GET
         path = u'%s' % os.path.join(self.directory, query.get('dir', ''))
         fileobject = FileObject(os.path.join(path, query.get('filename', '')), site=self)
-        if fileobject.filetype == "Folder":
+        if fileobject.filetype == "Folder" and not fileobject.is_empty:
             filelisting = FileListing(
                 os.path.join(path, fileobject.filename),
                 sorting_by=query.get('o', 'filename'),
                 sorting_order=query.get('ot', DEFAULT_SORTING_ORDER),
                 site=self)
-            filelisting = filelisting.files_walk_total()
-            if len(filelisting) > 100:
-                additional_files = len(filelisting) - 100
-                filelisting = filelisting[:100]
-            else:
-                additional_files = None
+            filelisting, results = filelisting.files_walk_head(100)
+            additional_files = None
+            if results > 100:
+                additional_files = results - 100
         else:
             filelisting = None
             additional_files = None
@@ -451,6 +537,7 @@ class FileBrowserSite(object):
                 signals.filebrowser_pre_delete.send(sender=request, path=fileobject.path, name=fileobject.filename, site=self)
                 fileobject.delete_versions()
                 fileobject.delete()
+                self.invalidate_listing(path)
                 signals.filebrowser_post_delete.send(sender=request, path=fileobject.path, name=fileobject.filename, site=self)
                 messages.add_message(request, messages.SUCCESS, _('Successfully deleted %s') % fileobject.filename)
             except OSError:
@@ -482,12 +569,14 @@ class FileBrowserSite(object):
                         signals.filebrowser_actions_pre_apply.send(sender=request, action_name=action_name, fileobject=[fileobject], site=self)
                         # Call the action to action
                         action_response = action(request=request, fileobjects=[fileobject])
+                        self.invalidate_listing(path)
                         # Post-action signal
                         signals.filebrowser_actions_post_apply.send(sender=request, action_name=action_name, fileobject=[fileobject], result=action_response, site=self)
                     if new_name != fileobject.filename:
                         signals.filebrowser_pre_rename.send(sender=request, path=fileobject.path, name=fileobject.filename, new_name=new_name, site=self)
                         fileobject.delete_versions()
                         self.storage.move(fileobject.path, os.path.join(fileobject.head, new_name))
+                        self.invalidate_listing(path)
                         signals.filebrowser_post_rename.send(sender=request, path=fileobject.path, name=fileobject.filename, new_name=new_name, site=self)
                         messages.add_message(request, messages.SUCCESS, _('Renaming was successful.'))
                     if isinstance(action_response, HttpResponse):
@@ -502,6 +591,11 @@ class FileBrowserSite(object):
         else:
             form = ChangeForm(initial={"name": fileobject.filename}, path=path, fileobject=fileobject, filebrowser_site=self)
 
+        # The versions of the page are generated with one decode of the image
+        # (and used with the version tags)
+        if fileobject.filetype == "Image":
+            fileobject._prefetch((), list(ADMIN_VERSIONS) + [ADMIN_THUMBNAIL])
+
         return render_to_response('filebrowser/detail.html', {
             'form': form,
             'fileobject': fileobject,
@@ -529,6 +623,74 @@ class FileBrowserSite(object):
             'filebrowser_site': self
         }, context_instance=Context(request, current_app=self.name))
 
+    def _version_file_view(self):
+        "version_file for staff members only (unless VERSION_FILE_PUBLIC)"
+        view = require_safe(self.version_file)
+        if not VERSION_FILE_PUBLIC:
+            view = staff_member_required(view)
+        return view
+
+    def _version_file_generate(self, fileobject, version_suffix):
+        "The version for version_file (Http404 if the original can not be opened or decoded)"
+        try:
+            version = fileobject.version_generate(version_suffix)
+        except Exception:
+            # like with the templatetag version (e.g. a corrupt image)
+            raise Http404
+        if not version.path:
+            raise Http404
+        return version
+
+    def version_file(self, request, version_suffix, path):
+        """
+        Return a version (generated with the first request).
+        path is relative to site.directory. The ETag is based on the original
+        image and the version settings, so conditional requests (with
+        If-None-Match) are answered without accessing the version.
+        """
+        path = os.path.normpath(path)
+        if version_suffix not in VERSIONS or os.path.isabs(path) or path.split(os.sep)[0] == os.pardir:
+            raise Http404
+        # no items within hidden or excluded folders either
+        if not all(self.filter_browse(name) for name in path.split(os.sep)):
+            raise Http404
+        fileobject = FileObject(os.path.join(self.directory, path), site=self)
+        if fileobject.filetype != 'Image' or fileobject.date is None:
+            raise Http404
+
+        etag = quote_etag(hashlib.md5(force_bytes('%s:%s:%r:%s' % (
+            fileobject.path, version_suffix, fileobject.date, version_signature(VERSIONS[version_suffix])))).hexdigest())
+        # If-Modified-Since is not used, Last-Modified does not include changes of the version settings
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match and (etag in parse_etags(if_none_match) or '*' in parse_etags(if_none_match)):
+            response = HttpResponseNotModified()
+        else:
+            version = self._version_file_generate(fileobject, version_suffix)
+            if VERSION_FILE_SENDFILE == 'X-Accel-Redirect':
+                response = HttpResponse(content_type=version.mimetype[0])
+                response['X-Accel-Redirect'] = version.url
+            elif VERSION_FILE_SENDFILE == 'X-Sendfile':
+                response = HttpResponse(content_type=version.mimetype[0])
+                response['X-Sendfile'] = self.storage.path(version.path)
+            else:
+                try:
+                    f = self.storage.open(version.path)
+                except (IOError, OSError):
+                    # recorded with the version manifest, but removed meanwhile (checked with the storage again)
+                    fileobject._invalidate_versions([version_suffix])
+                    version = self._version_file_generate(fileobject, version_suffix)
+                    try:
+                        f = self.storage.open(version.path)
+                    except (IOError, OSError):
+                        raise Http404
+                response = StreamingHttpResponse(file_chunks(f), content_type=version.mimetype[0])
+                response['Content-Length'] = version.filesize
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(fileobject.date)
+        # not stored by shared caches, unless versions are returned to all users
+        response['Cache-Control'] = '%s, max-age=%d' % (VERSION_FILE_PUBLIC and 'public' or 'private', VERSION_FILE_MAX_AGE)
+        return response
+
     def _upload_file(self, request):
         """
         Upload file to the server.
@@ -576,6 +738,7 @@ class FileBrowserSite(object):
             if DEFAULT_PERMISSIONS is not None:
                 os.chmod(full_path, DEFAULT_PERMISSIONS)
 
+            self.invalidate_listing(path)
             f = FileObject(smart_text(file_name), site=self)
             signals.filebrowser_post_upload.send(sender=request, path=folder, file=f, site=self)
 
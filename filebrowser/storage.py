@@ -3,11 +3,35 @@
 # PYTHON IMPORTS
 import os
 import shutil
+import time
+import uuid
+try:
+    from os import scandir
+except ImportError:
+    # Python < 3.5
+    scandir = None
 
 # DJANGO IMPORTS
 from django.core.files.move import file_move_safe
 
 
+def _scandir(path):
+    "Yields (name, is_dir, stat) for the contents of path. stat is None for broken symlinks."
+    if scandir is not None:
+        for entry in scandir(path):
+            try:
+                yield entry.name, entry.is_dir(), entry.stat()
+            except OSError:
+                yield entry.name, False, None
+    else:
+        for name in os.listdir(path):
+            entry_path = os.path.join(path, name)
+            try:
+                yield name, os.path.isdir(entry_path), os.stat(entry_path)
+            except OSError:
+                yield name, False, None
+
+
 class StorageMixin(object):
     """
     Adds some useful methods to the Storage class.
@@ -45,6 +69,38 @@ class StorageMixin(object):
         """
         raise NotImplementedError()
 
+    def scandir(self, name):
+        """
+        Returns a list of (name, is_dir, size, mtime) tuples for the contents
+        of the directory name, read in one pass. Analogue to os.scandir().
+
+        Directories come first, like with listdir(). size and mtime (as float)
+        are None if they can not be determined.
+        """
+        raise NotImplementedError()
+
+    def has_children(self, name):
+        """
+        Returns true if the directory name contains any file or directory.
+        Stops with the first entry (instead of listing the directory).
+        """
+        raise NotImplementedError()
+
+    def read_range(self, name, offset, length):
+        """
+        Returns (at most) length bytes of the file name, starting with offset.
+        Reads only this part of the file (e.g. with a ranged request).
+        """
+        raise NotImplementedError()
+
+    def atomic_save(self, name, content):
+        """
+        Saves content as name, replacing an existing file atomically (the file
+        is either the old or the new one, never missing or incomplete).
+        Returns name.
+        """
+        raise NotImplementedError()
+
 
 class FileSystemStorageMixin(StorageMixin):
 
@@ -63,6 +119,66 @@ class FileSystemStorageMixin(StorageMixin):
     def rmtree(self, name):
         shutil.rmtree(self.path(name))
 
+    def scandir(self, name):
+        dirs, files = [], []
+        for entry_name, is_dir, st in _scandir(self.path(name)):
+            if st is None:
+                files.append((entry_name, False, None, None))
+            elif is_dir:
+                dirs.append((entry_name, True, st.st_size, st.st_mtime))
+            else:
+                files.append((entry_name, False, st.st_size, st.st_mtime))
+        return dirs + files
+
+    def has_children(self, name):
+        path = self.path(name)
+        if scandir is None:
+            return bool(os.listdir(path))
+        iterator = scandir(path)
+        try:
+            for entry in iterator:
+                return True
+            return False
+        finally:
+            # Python >= 3.6
+            if hasattr(iterator, 'close'):
+                iterator.close()
+
+    def read_range(self, name, offset, length):
+        with open(self.path(name), 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def atomic_save(self, name, content):
+        path = self.path(name)
+        directory, filename = os.path.split(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # a hidden temporary file within the same directory (and filesystem),
+        # created with the umask (like with save)
+        tmp_path = os.path.join(directory, '.%s.%s' % (filename, uuid.uuid4().hex[:12]))
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                content.seek(0)
+                for chunk in content.chunks():
+                    f.write(chunk)
+            # Django >= 1.7
+            if getattr(self, 'file_permissions_mode', None) is not None:
+                os.chmod(tmp_path, self.file_permissions_mode)
+            if hasattr(os, 'replace'):
+                # Python >= 3.3, also replaces existing files with Windows
+                os.replace(tmp_path, path)
+            else:
+                if os.name == 'nt' and os.path.exists(path):
+                    os.remove(path)
+                os.rename(tmp_path, path)
+        finally:
+            # left over with an error
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return name
+
 
 class S3BotoStorageMixin(StorageMixin):
 
@@ -80,12 +196,8 @@ class S3BotoStorageMixin(StorageMixin):
             return False
 
         name = self._normalize_name(self._clean_name(name))
-        dirlist = self.bucket.list(self._encode_name(name))
-
-        # Check whether the iterator is empty
-        for item in dirlist:
-            return True
-        return False
+        # One request for (at most) one key
+        return bool(self.bucket.get_all_keys(prefix=self._encode_name(name), max_keys=1))
 
     def move(self, old_file_name, new_file_name, allow_overwrite=False):
 
@@ -108,6 +220,47 @@ class S3BotoStorageMixin(StorageMixin):
     def makedirs(self, name):
         pass
 
+    def scandir(self, name):
+        from boto.utils import parse_ts
+        name = self._normalize_name(self._clean_name(name))
+        if name and not name.endswith('/'):
+            name += '/'
+        dirs, files = [], []
+        for item in self.bucket.list(self._encode_name(name), '/'):
+            item_name = item.name[len(name):]
+            if item.name.endswith('/'):
+                dirs.append((item_name.rstrip('/'), True, None, None))
+            elif item_name:
+                # same as FileObject.date with modified_time()
+                mtime = time.mktime(parse_ts(item.last_modified).timetuple())
+                files.append((item_name, False, item.size, mtime))
+        return dirs + files
+
+    def has_children(self, name):
+        name = self._normalize_name(self._clean_name(name))
+        if name and not name.endswith('/'):
+            name += '/'
+        # One request for (at most) two keys, the first one may be the directory itself
+        keys = self.bucket.get_all_keys(prefix=self._encode_name(name), max_keys=2)
+        return any(key.name != name for key in keys)
+
+    def read_range(self, name, offset, length):
+        from boto.exception import S3ResponseError
+        key = self.bucket.new_key(self._encode_name(self._normalize_name(self._clean_name(name))))
+        try:
+            # One request (without downloading the whole file)
+            return key.get_contents_as_string(headers={'Range': 'bytes=%d-%d' % (offset, offset + length - 1)})
+        except S3ResponseError as e:
+            # offset is beyond the end of the file
+            if e.status == 416:
+                return b''
+            raise
+
+    def atomic_save(self, name, content):
+        # uploads replace a key atomically
+        content.seek(0)
+        return self._save(name, content)
+
     def rmtree(self, name):
         name = self._normalize_name(self._clean_name(name))
         dirlist = self.bucket.list(self._encode_name(name))
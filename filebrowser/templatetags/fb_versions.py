@@ -9,15 +9,59 @@ from time import gmtime
 from django.template import Library, Node, Variable, VariableDoesNotExist, TemplateSyntaxError
 from django.conf import settings
 from django.core.files import File
+from django.core.urlresolvers import reverse
 
 
 # FILEBROWSER IMPORTS
-from filebrowser.settings import VERSIONS, PLACEHOLDER, SHOW_PLACEHOLDER, FORCE_PLACEHOLDER
+from filebrowser.settings import VERSIONS, PLACEHOLDER, SHOW_PLACEHOLDER, FORCE_PLACEHOLDER, VERSION_GENERATE_ASYNC
 from filebrowser.base import FileObject
 from filebrowser.sites import get_default_site
+from filebrowser.versions import version_generator
 register = Library()
 
 
+def get_prefetched_version(source, version_suffix):
+    "Version of a FileObject retrieved with FileListing.prefetch (or None)"
+    if FORCE_PLACEHOLDER or not isinstance(source, FileObject) or not source._versions_stored:
+        return None
+    return source._versions_stored.get(version_suffix)
+
+
+def get_fileobject(source, site):
+    """
+    FileObject for source (a FileObject, a File or a path), with placeholders.
+    A FileObject is reused (with its stored attributes, e.g. the date used
+    with the version manifest).
+    """
+    fileobject = None
+    if isinstance(source, FileObject):
+        fileobject = source
+        source = source.path
+    elif isinstance(source, File):
+        source = source.name
+    if FORCE_PLACEHOLDER or (SHOW_PLACEHOLDER and not site.storage.isfile(source)):
+        return FileObject(PLACEHOLDER, site=site)
+    if fileobject is None:
+        fileobject = FileObject(source, site=site)
+    return fileobject
+
+
+def get_version(fileobject, version_suffix):
+    """
+    Version of fileobject. With VERSION_GENERATE_ASYNC, a missing/outdated
+    version is generated in the background (see VersionGenerator) and the
+    version of the placeholder (or the original) is returned until then.
+    """
+    if not VERSION_GENERATE_ASYNC or fileobject.path == PLACEHOLDER:
+        return fileobject.version_generate(version_suffix)
+    version = version_generator.version(fileobject, version_suffix, None)
+    if version is None:
+        if PLACEHOLDER:
+            return FileObject(PLACEHOLDER, site=fileobject.site).version_generate(version_suffix)
+        return fileobject
+    return version
+
+
 class VersionNode(Node):
     def __init__(self, src, suffix):
         self.src = src
@@ -31,18 +75,13 @@ class VersionNode(Node):
             return ""
         if version_suffix not in VERSIONS:
             return ""  # FIXME: should this throw an error?
-        if isinstance(source, FileObject):
-            source = source.path
-        elif isinstance(source, File):
-            source = source.name
-        else:  # string
-            source = source
+        version = get_prefetched_version(source, version_suffix)
+        if version is not None:
+            return version.url
         site = context.get('filebrowser_site', get_default_site())
-        if FORCE_PLACEHOLDER or (SHOW_PLACEHOLDER and not site.storage.isfile(source)):
-            source = PLACEHOLDER
-        fileobject = FileObject(source, site=site)
+        fileobject = get_fileobject(source, site)
         try:
-            version = fileobject.version_generate(version_suffix)
+            version = get_version(fileobject, version_suffix)
             return version.url
         except Exception as e:
             if settings.TEMPLATE_DEBUG:
@@ -80,18 +119,14 @@ class VersionObjectNode(Node):
             return None
         if version_suffix not in VERSIONS:
             return ""  # FIXME: should this throw an error?
-        if isinstance(source, FileObject):
-            source = source.path
-        elif isinstance(source, File):
-            source = source.name
-        else:  # string
-            source = source
+        version = get_prefetched_version(source, version_suffix)
+        if version is not None:
+            context[self.var_name] = version
+            return ""
         site = context.get('filebrowser_site', get_default_site())
-        if FORCE_PLACEHOLDER or (SHOW_PLACEHOLDER and not site.storage.isfile(source)):
-            source = PLACEHOLDER
-        fileobject = FileObject(source, site=site)
+        fileobject = get_fileobject(source, site)
         try:
-            version = fileobject.version_generate(version_suffix)
+            version = get_version(fileobject, version_suffix)
             context[self.var_name] = version
         except Exception as e:
             if settings.TEMPLATE_DEBUG:
@@ -118,6 +153,45 @@ def version_object(parser, token):
     return VersionObjectNode(parser.compile_filter(bits[1]), parser.compile_filter(bits[2]), bits[4])
 
 
+class VersionURLNode(Node):
+    def __init__(self, src, suffix):
+        self.src = src
+        self.suffix = suffix
+
+    def render(self, context):
+        try:
+            version_suffix = self.suffix.resolve(context)
+            source = self.src.resolve(context)
+        except VariableDoesNotExist:
+            return ""
+        if version_suffix not in VERSIONS:
+            return ""  # FIXME: should this throw an error?
+        site = context.get('filebrowser_site', get_default_site())
+        if isinstance(source, FileObject):
+            source = source.path
+        elif isinstance(source, File):
+            source = source.name
+        path = FileObject(source, site=site).path_relative_directory
+        return reverse("filebrowser:fb_version_file", current_app=site.name, kwargs={'version_suffix': version_suffix, 'path': path})
+
+
+def version_url(parser, token):
+    """
+    Displaying the URL of a version with the view fb_version_file (without accessing
+    the storage, the version is generated with the first request of the URL).
+    {% version_url fileobject version_suffix %}
+
+    Use {% version_url fileobject 'medium' %} in order to
+    display the URL of the medium-size version of an image.
+    version_suffix can be a string or a variable. if version_suffix is a string, use quotes.
+    """
+
+    bits = token.split_contents()
+    if len(bits) != 3:
+        raise TemplateSyntaxError("'version_url' tag takes 2 arguments")
+    return VersionURLNode(parser.compile_filter(bits[1]), parser.compile_filter(bits[2]))
+
+
 class VersionSettingNode(Node):
     def __init__(self, version_suffix):
         if (version_suffix[0] == version_suffix[-1] and version_suffix[0] in ('"', "'")):
@@ -154,4 +228,5 @@ def version_setting(parser, token):
 
 register.tag(version)
 register.tag(version_object)
+register.tag(version_url)
 register.tag(version_setting)
@@ -2,19 +2,31 @@
 
 # PYTHON IMPORTS
 import os
+import pickle
 import ntpath
 import posixpath
 import shutil
+import tempfile
+import threading
 
 # DJANGO IMPORTS
 from django.test import TestCase
+from django.core.files.base import ContentFile
 from django.contrib.auth.models import User
 from django.utils.encoding import filepath_to_uri
 
 # FILEBROWSER IMPORTS
 import filebrowser
+import filebrowser.columnar
 from filebrowser.base import FileObject, FileListing
+from filebrowser.cache import ListingCache
+from filebrowser.jobs import VersionJobQueue
+from filebrowser.columnar import ColumnarListing
+from filebrowser.metadata import MetadataIndex, ImageMetadataCache
+from filebrowser.search import TrigramIndex
 from filebrowser.sites import site
+from filebrowser.utils import get_image_dimensions, scale_and_crop, Image
+from filebrowser.versions import VersionManifest, VersionLock
 
 TESTS_PATH = os.path.dirname(os.path.abspath(__file__))
 FILEBROWSER_PATH = os.path.split(TESTS_PATH)[0]
@@ -188,6 +200,8 @@ class FileObjectAttributeTests(TestCase):
         self.assertEqual(self.f_image.filename_root, 'testimage')
         self.assertEqual(self.f_image.extension, '.jpg')
         self.assertEqual(self.f_image.mimetype, ('image/jpeg', None))
+        self.assertFalse(hasattr(self.f_image, '__dict__'))
+        self.assertEqual(FileObject('fb_test_directory/TESTIMAGE.JPG', site=site).filetype, 'Image')
 
     def test_general_attributes(self):
         """
@@ -246,10 +260,48 @@ class FileObjectAttributeTests(TestCase):
         # orientation
         """
         self.assertEqual(self.f_image.dimensions, (1000, 750))
+        self.assertEqual(site.storage.read_range(self.f_image.path, 0, 2), b'\xff\xd8')
+        self.assertEqual(get_image_dimensions(lambda offset, length: site.storage.read_range(self.f_image.path, offset, length)), (1000, 750))
+        self.assertEqual(get_image_dimensions(lambda offset, length: b'GIF89a\x0a\x00\x14\x00'[offset:offset + length]), (10, 20))
+        self.assertEqual(get_image_dimensions(lambda offset, length: b'no image'[offset:offset + length]), None)
         self.assertEqual(self.f_image.width, 1000)
         self.assertEqual(self.f_image.height, 750)
         self.assertEqual(self.f_image.aspectratio, 1.3333333333333333)
         self.assertEqual(self.f_image.orientation, 'Landscape')
+        self.assertEqual(self.f_image.image_format, 'JPEG')
+        self.assertEqual(self.f_image.image_mode, 'RGB')
+
+    def test_image_metadata_cache(self):
+        """
+        FileObject image attributes with an ImageMetadataCache
+
+        # dimensions
+        # ImageMetadataCache.get
+        # ImageMetadataCache.remove
+        # ImageMetadataCache.prune
+        """
+        cache_dir = tempfile.mkdtemp()
+        original_image_metadata = getattr(site, 'image_metadata', None)
+        site.image_metadata = ImageMetadataCache(site, os.path.join(cache_dir, "filebrowser.sqlite3"))
+        try:
+            self.assertEqual(self.f_image.dimensions, (1000, 750))
+            f_image = FileObject(self.f_image.path, site=site)
+            self.assertEqual(site.image_metadata.get(f_image.path, f_image.filesize, f_image.date), (1000, 750, 'JPEG', 'RGB'))
+            # stale entries are not used (but kept until overwritten)
+            self.assertEqual(site.image_metadata.get(f_image.path, f_image.filesize + 1, f_image.date), None)
+            self.assertEqual(site.image_metadata.get(f_image.path, f_image.filesize, f_image.date + 0.5), (1000, 750, 'JPEG', 'RGB'))
+            self.assertEqual(site.image_metadata.get(f_image.path, f_image.filesize, f_image.date), (1000, 750, 'JPEG', 'RGB'))
+            site.image_metadata.set(f_image.path, f_image.filesize + 1, f_image.date, (1, 1, 'JPEG', 'L'))
+            self.assertEqual(site.image_metadata.get(f_image.path, f_image.filesize, f_image.date), None)
+            self.assertEqual(f_image.dimensions, (1000, 750))
+            site.image_metadata.remove(os.path.join(self.directory, "fb_tmp_dir"))
+            self.assertEqual(site.image_metadata.get(f_image.path, f_image.filesize, f_image.date), None)
+            self.assertEqual(site.image_metadata.prune(), 0)
+            site.image_metadata.set("fb_test_directory/missing.jpg", 1, 1.0, (1, 1, 'JPEG', 'L'))
+            self.assertEqual(site.image_metadata.prune(), 1)
+        finally:
+            site.image_metadata = original_image_metadata
+            shutil.rmtree(cache_dir)
 
     def test_folder_attributes(self):
         """
@@ -277,6 +329,8 @@ class FileObjectAttributeTests(TestCase):
         #self.assertEqual(self.f_folder_alt.folder, "fb_tmp_dir/fb_tmp_dir_sub")  # equals dirname
         self.assertEqual(self.f_folder_alt.is_folder, True)
         self.assertEqual(self.f_folder_alt.is_empty, True)
+        self.assertEqual(site.storage.has_children(self.f_folder.path), True)
+        self.assertEqual(site.storage.has_children(self.f_folder_alt.path), False)
 
     def test_version_attributes_1(self):
         """
@@ -416,6 +470,182 @@ class FileObjectAttributeTests(TestCase):
         self.assertEqual(f_version.versions(), [])
         self.assertEqual(f_version.admin_versions(), [])
 
+    def test_versions_generate(self):
+        """
+        FileObject versions_generate
+
+        # versions_generate(suffixes)
+        """
+        filebrowser.base.VERSIONS_BASEDIR = ""
+        filebrowser.base.VERSIONS = {
+            'admin_thumbnail': {'verbose_name': 'Admin Thumbnail', 'width': 60, 'height': 60, 'opts': 'crop'},
+            'medium': {'verbose_name': 'Medium', 'width': 300, 'height': '', 'opts': ''},
+            'large': {'verbose_name': 'Large', 'width': 600, 'height': '', 'opts': ''},
+        }
+        versions = self.f_image.versions_generate()
+        self.assertEqual(sorted(versions), ['admin_thumbnail', 'large', 'medium'])
+        self.assertEqual(versions['medium'].path, "fb_test_directory/fb_tmp_dir/fb_tmp_dir_sub/testimage_medium.jpg")
+        self.assertEqual(versions['admin_thumbnail'].dimensions, (60, 60))
+        self.assertEqual(versions['medium'].dimensions, (300, 225))
+        self.assertEqual(versions['large'].dimensions, (600, 450))
+        # versions which are up to date are not generated again
+        self.assertEqual(self.f_image.versions_generate(['medium'])['medium'].path, versions['medium'].path)
+
+        # JPEG decoded with DCT scaling
+        im = Image.open(os.path.join(self.tmpdir_path, "testimage.jpg"))
+        self.assertEqual(scale_and_crop(im, 60, 60, 'crop', reducing_gap=2.0).size, (60, 60))
+        self.assertEqual(im.size, (250, 188))
+
+    def test_version_manifest(self):
+        """
+        FileObject version_generate with a VersionManifest
+
+        # version_is_fresh(suffix)
+        # version_generate(suffix)
+        # delete_versions
+        """
+        filebrowser.base.VERSIONS_BASEDIR = ""
+        filebrowser.base.VERSIONS = {
+            'large': {'verbose_name': 'Large', 'width': 600, 'height': '', 'opts': ''},
+        }
+        original_version_manifest = getattr(site, 'version_manifest', None)
+        site.version_manifest = VersionManifest(site)
+        try:
+            self.assertEqual(self.f_image.version_is_fresh("large"), False)
+            f_version = self.f_image.version_generate("large")
+            self.assertEqual(self.f_image.version_is_fresh("large"), True)
+            self.assertEqual(site.version_manifest.get(self.f_image.path, self.f_image.date, "large"), (f_version.path, f_version.date))
+            # outdated entries are not used
+            self.assertEqual(site.version_manifest.get(self.f_image.path, self.f_image.date + 1, "large"), None)
+            self.assertEqual(self.f_image.version_generate("large").path, f_version.path)
+            self.f_image.delete_versions()
+            self.assertEqual(site.version_manifest.get(self.f_image.path, self.f_image.date, "large"), None)
+            self.assertEqual(self.f_image.version_is_fresh("large"), False)
+        finally:
+            site.version_manifest = original_version_manifest
+
+    def test_version_names_hashed(self):
+        """
+        FileObject versions with VERSION_NAMES_HASHED
+
+        # version_hash(suffix)
+        # version_generate(suffix)
+        # is_version
+        # original
+        # delete_versions
+        """
+        filebrowser.base.VERSIONS_BASEDIR = ""
+        filebrowser.base.VERSIONS = {
+            'large': {'verbose_name': 'Large', 'width': 600, 'height': '', 'opts': ''},
+        }
+        filebrowser.base.VERSION_NAMES_HASHED = True
+        try:
+            f_plain = self.f_image._version_name("large")
+            version_hash = self.f_image.version_hash("large")
+            self.assertEqual(len(version_hash), 12)
+            f_version = self.f_image.version_generate("large")
+            self.assertEqual(f_version.filename, "testimage_large.%s.jpg" % version_hash)
+            self.assertEqual(f_version.is_version, True)
+            self.assertEqual(f_version.original.path, self.f_image.path)
+            self.assertEqual(site.filter_browse(f_version.filename), False)
+            # the same hash with a FileObject from a listing (fractional modification time)
+            os.utime(self.f_image.path_full, (1400000000.75, 1400000000.75))
+            f_image = FileObject(self.f_image.path, site=site)
+            f_listed = [f for f in FileListing(self.f_image.head, site=site).files_listing_total() if f.path == f_image.path][0]
+            self.assertNotEqual(f_image.version_hash("large"), version_hash)
+            self.assertEqual(f_listed.version_hash("large"), f_image.version_hash("large"))
+            version_hash = f_image.version_hash("large")
+            f_version = f_image.version_generate("large")
+            # new settings result with a new name (the outdated version is kept)
+            filebrowser.base.VERSIONS['large']['width'] = 500
+            f_image = FileObject(self.f_image.path, site=site)
+            self.assertNotEqual(f_image.version_hash("large"), version_hash)
+            f_version_new = f_image.version_generate("large")
+            self.assertEqual(site.storage.exists(f_version.path), True)
+            self.assertEqual(f_version_new.width, 500)
+            f_image.delete_versions()
+            self.assertEqual(site.storage.exists(f_version.path), False)
+            self.assertEqual(site.storage.exists(f_version_new.path), False)
+            self.assertEqual(site.storage.exists(os.path.join(f_image.head, f_plain)), False)
+        finally:
+            filebrowser.base.VERSION_NAMES_HASHED = False
+
+    def test_version_lock(self):
+        """
+        FileObject versions generated with a VersionLock and replaced atomically
+
+        # VersionLock.hold
+        # storage.atomic_save
+        """
+        filebrowser.base.VERSIONS_BASEDIR = ""
+        filebrowser.base.VERSIONS = {
+            'large': {'verbose_name': 'Large', 'width': 600, 'height': '', 'opts': ''},
+        }
+        lock_dir = tempfile.mkdtemp()
+        version_lock = VersionLock(lock_dir, timeout=0.1)
+        results = []
+
+        def hold():
+            with version_lock.hold(site, self.f_image.path) as waited:
+                results.append(waited)
+
+        try:
+            with version_lock.hold(site, self.f_image.path) as waited:
+                self.assertEqual(waited, False)
+                # held by another thread
+                thread = threading.Thread(target=hold)
+                thread.start()
+                thread.join()
+                self.assertEqual(results, [True])
+            self.assertEqual(version_lock._locks, {})
+        finally:
+            shutil.rmtree(lock_dir)
+
+        f_version = self.f_image.version_generate("large")
+        size = f_version.filesize
+        self.assertEqual(site.storage.atomic_save(f_version.path, ContentFile(b"version")), f_version.path)
+        self.assertEqual(FileObject(f_version.path, site=site).filesize, 7)
+        self.assertNotEqual(size, 7)
+        self.assertEqual([name for name in site.storage.listdir(f_version.head)[1] if name.startswith('.' + f_version.filename)], [])
+
+    def test_version_queue(self):
+        """
+        FileObject versions with a VersionJobQueue
+
+        # VersionJobQueue.enqueue
+        # VersionJobQueue.run_job
+        # VersionJobQueue.fail
+        # VersionJobQueue.retry_failed
+        """
+        filebrowser.base.VERSIONS_BASEDIR = ""
+        filebrowser.base.VERSIONS = {
+            'large': {'verbose_name': 'Large', 'width': 600, 'height': '', 'opts': ''},
+        }
+        original_versions = filebrowser.jobs.VERSIONS
+        filebrowser.jobs.VERSIONS = filebrowser.base.VERSIONS
+        queue_dir = tempfile.mkdtemp()
+        version_queue = VersionJobQueue(site, os.path.join(queue_dir, "filebrowser.sqlite3"), max_attempts=1)
+        try:
+            version_queue.enqueue(self.f_image.path, ["large"])
+            version_queue.enqueue(self.f_image.path, ["large"])
+            self.assertEqual(version_queue.status(), {'pending': 1, 'running': 0, 'failed': 0})
+            self.assertEqual(version_queue.run_job(), self.f_image.path)
+            self.assertEqual(version_queue.run_job(), None)
+            self.assertEqual(version_queue.status(), {'pending': 0, 'running': 0, 'failed': 0})
+            self.assertEqual(self.f_image.version_is_fresh("large"), True)
+            # failed jobs
+            version_queue.enqueue(self.f_image.path, ["large"])
+            path, jobs = version_queue.claim()
+            version_queue.fail(path, jobs, "IOError")
+            self.assertEqual(version_queue.failed(), [(self.f_image.path, "large", 1, "IOError")])
+            self.assertEqual(version_queue.retry_failed(), 1)
+            self.assertEqual(version_queue.status(), {'pending': 1, 'running': 0, 'failed': 0})
+            version_queue.remove(os.path.join(self.directory, "fb_tmp_dir"))
+            self.assertEqual(version_queue.status(), {'pending': 0, 'running': 0, 'failed': 0})
+        finally:
+            filebrowser.jobs.VERSIONS = original_versions
+            shutil.rmtree(queue_dir)
+
     def test_delete(self):
         """
         FileObject delete methods
@@ -571,6 +801,93 @@ class FileListingTests(TestCase):
         self.assertEqual(self.f_listing.results_listing_total(), 2)
         self.assertEqual(self.f_listing.results_listing_filtered(), 2)
 
+    def test_scandir(self):
+        """
+        FileListing scandir
+
+        # scandir
+        # files_listing_total (metadata stored from scandir)
+        """
+        self.assertEqual(self.f_listing_file.scandir(), [])
+        entries = dict((entry[0], entry) for entry in self.f_listing.scandir())
+        self.assertEqual(sorted(entries.keys()), [u'fb_tmp_dir', u'testimage.jpg'])
+        self.assertEqual(entries[u'fb_tmp_dir'][1], True)
+        self.assertEqual(entries[u'testimage.jpg'][1:3], (False, 870037))
+        for fileobject in self.f_listing.files_listing_total():
+            self.assertEqual(fileobject._exists_stored, True)
+            self.assertNotEqual(fileobject._date_stored, None)
+        self.assertEqual([f.filesize for f in self.f_listing.files_listing_total()], [870037, entries[u'fb_tmp_dir'][2]])
+
+    def test_scandir_date(self):
+        """
+        FileListing scandir, date the same as with a FileObject (whole seconds)
+        """
+        # fractional modification time
+        os.utime(os.path.join(self.directory_path, "testimage.jpg"), (1400000000.75, 1400000000.75))
+        for fileobject in self.f_listing.files_listing_filtered():
+            self.assertEqual(fileobject.date, FileObject(fileobject.path, site=site).date)
+        self.assertEqual(self.f_listing.files_listing_filtered()[1].date, 1400000000)
+
+    def test_pickle(self):
+        """
+        FileObjects (with a path and from a listing) pickled with the name of the site
+        """
+        f_image = FileObject(os.path.join(self.directory, "testimage.jpg"), site=site)
+        for fileobject in [f_image] + self.f_listing.files_listing_filtered():
+            fileobject.filesize
+            f_unpickled = pickle.loads(pickle.dumps(fileobject))
+            self.assertEqual(f_unpickled.site, site)
+            self.assertEqual(f_unpickled.path, fileobject.path)
+            self.assertEqual(f_unpickled.filesize, fileobject.filesize)
+            self.assertEqual(f_unpickled.date, fileobject.date)
+
+    def test_listing_lazy(self):
+        """
+        FileListing with lazy=True
+
+        # sorting_needs_metadata
+        # files_listing_total
+        """
+        f_listing_lazy = FileListing(self.directory, sorting_by='filename_lower', sorting_order='asc', lazy=True)
+        self.assertEqual(f_listing_lazy.sorting_needs_metadata(), False)
+        self.assertEqual(self.f_listing.sorting_needs_metadata(), True)
+        files = f_listing_lazy.files_listing_total()
+        self.assertEqual(list(f.path for f in files), [u'fb_test_directory/fb_tmp_dir', u'fb_test_directory/testimage.jpg'])
+        self.assertEqual([f._is_folder_stored for f in files], [True, False])
+        self.assertEqual([f._date_stored for f in files], [None, None])
+        self.assertEqual(files[1].filetype, 'Image')
+        self.assertEqual(files[1].filesize, 870037)
+
+    def test_sort_limit(self):
+        """
+        FileListing sort with limit
+
+        # sort
+        # files_listing_filtered (sort=False)
+        """
+        files = self.f_listing.files_listing_filtered(sort=False)
+        files_sorted = self.f_listing.sort(files)
+        files_partial = self.f_listing.sort(files, limit=1)
+        self.assertEqual(len(files_partial), 2)
+        self.assertEqual(files_partial[0].path, files_sorted[0].path)
+        self.assertEqual(list(f.path for f in files_partial[:1]), [u'fb_test_directory/testimage.jpg'])
+        self.assertEqual(list(f.path for f in files_partial), list(f.path for f in files_sorted))
+
+    def test_prefetch(self):
+        """
+        FileListing prefetch
+
+        # prefetch
+        """
+        f_listing = FileListing(self.directory, sorting_by='filename_lower', lazy=True)
+        files = f_listing.prefetch(f_listing.files_listing_total(), workers=2)
+        self.assertEqual(list(f.path for f in files), [u'fb_test_directory/fb_tmp_dir', u'fb_test_directory/testimage.jpg'])
+        # attributes are stored with the FileObjects
+        self.assertEqual(files[1]._filesize_stored, 870037)
+        self.assertEqual(files[1]._dimensions_stored, (1000, 750))
+        self.assertEqual(files[0]._dimensions_stored, None)
+        self.assertEqual(files[1]._versions_stored, None)
+
     def test_walk(self):
         """
         FileObject walk
@@ -588,6 +905,203 @@ class FileListingTests(TestCase):
         self.assertEqual(self.f_listing.results_walk_total(), 4)
         self.assertEqual(self.f_listing.results_walk_filtered(), 4)
 
+    def test_walk_parallel(self):
+        """
+        FileObject walk with concurrent workers
+
+        # walk
+        """
+        self.assertEqual(list(self.f_listing.walk(workers=4)), list(self.f_listing.walk()))
+        self.assertEqual(sorted(self.f_listing.walk(workers=4, ordered=False)), sorted(self.f_listing.walk()))
+        self.assertEqual(self.f_listing_file.walk(workers=4), [])
+
+    def test_walk_cycle(self):
+        """
+        FileObject walk with a symbolic link creating a cycle
+
+        # walk
+        # files_walk_iterator
+        """
+        if not hasattr(os, 'symlink'):
+            return
+        os.symlink(self.directory_path, os.path.join(self.tmpdir_path, "fb_tmp_link"))
+        self.assertEqual(list(self.f_listing.walk()), [u'fb_tmp_dir/fb_tmp_dir_sub/fb_tmp_link', u'fb_tmp_dir/fb_tmp_dir_sub/testimage.jpg', u'fb_tmp_dir/fb_tmp_dir_sub', u'fb_tmp_dir', u'testimage.jpg'])
+        self.assertEqual(len(list(self.f_listing.files_walk_iterator())), 5)
+
+    def test_filter_name_func(self):
+        """
+        FileListing with filter_name_func (browse filter)
+
+        # files_listing_total
+        # results_listing_total
+        # files_walk_iterator
+        """
+        shutil.copy(self.image_path, os.path.join(self.directory_path, "testimage_thumbnail.JPG"))
+        shutil.copy(self.image_path, os.path.join(self.directory_path, ".testimage.jpg"))
+        f_listing = FileListing(self.directory, sorting_by='date', sorting_order='desc', filter_name_func=site.filter_browse)
+        self.assertEqual(list(f.path for f in f_listing.files_listing_total()), [u'fb_test_directory/testimage.jpg', u'fb_test_directory/fb_tmp_dir'])
+        self.assertEqual(f_listing.results_listing_total(), 2)
+        self.assertEqual(len(list(f_listing.files_walk_iterator())), 4)
+        self.assertEqual(len(list(self.f_listing.files_walk_iterator())), 6)
+
+    def test_listing_cache(self):
+        """
+        FileListing with a ListingCache
+
+        # files_listing_total
+        # ListingCache.get
+        # ListingCache.invalidate
+        """
+        original_listing_cache = getattr(site, 'listing_cache', None)
+        site.listing_cache = ListingCache(site, timeout=60, max_entries=10)
+        try:
+            self.assertEqual(site.listing_cache.get(self.directory)[0], None)
+            f_listing = FileListing(self.directory, sorting_by='date', sorting_order='desc')
+            self.assertEqual(list(f.path for f in f_listing.files_listing_total()), [u'fb_test_directory/testimage.jpg', u'fb_test_directory/fb_tmp_dir'])
+            self.assertEqual(sorted(entry[0] for entry in site.listing_cache.get(self.directory)[0]), [u'fb_tmp_dir', u'testimage.jpg'])
+            f_listing = FileListing(self.directory, sorting_by='date', sorting_order='desc')
+            self.assertEqual(f_listing.files_listing_total()[0].filesize, 870037)
+            key = site.listing_cache.get(self.directory)[1]
+            site.listing_cache.invalidate(self.directory)
+            self.assertEqual(site.listing_cache.get(self.directory)[0], None)
+            # also entries cached with another modification time are not found anymore
+            self.assertNotEqual(site.listing_cache.get(self.directory)[1], key)
+        finally:
+            site.listing_cache = original_listing_cache
+
+    def test_search_index(self):
+        """
+        TrigramIndex (search with SEARCH_TRAVERSE)
+
+        # search
+        # count
+        # remove/move
+        """
+        index = TrigramIndex(site)
+        self.assertEqual(list(f.path for f in index.search('', 'testimage')), [u'fb_test_directory/fb_tmp_dir/fb_tmp_dir_sub/testimage.jpg', u'fb_test_directory/testimage.jpg'])
+        self.assertEqual(list(f.path for f in index.search('fb_tmp_dir', 'test')), [u'fb_test_directory/fb_tmp_dir/fb_tmp_dir_sub/testimage.jpg'])
+        self.assertEqual(list(f.path for f in index.search('', '^fb_.*sub$')), [u'fb_test_directory/fb_tmp_dir/fb_tmp_dir_sub'])
+        self.assertEqual(index.search('', 'nomatch'), [])
+        self.assertEqual(index.count(''), 4)
+        self.assertEqual(index.count('fb_tmp_dir'), 2)
+        index.move('fb_tmp_dir', 'fb_moved')
+        self.assertEqual(list(f.path for f in index.search('fb_moved', 'test')), [u'fb_test_directory/fb_moved/fb_tmp_dir_sub/testimage.jpg'])
+        index.remove('fb_moved')
+        self.assertEqual(index.count(''), 1)
+        # changes of other processes are found with the modification times of directories
+        self.assertEqual(index.changed(), False)
+        shutil.copy(self.image_path, os.path.join(self.directory_path, "testimage2.jpg"))
+        self.assertEqual(index.changed(), True)
+        index.check_interval = 0
+        index._checked -= 1
+        # the previous index is used while rebuilding
+        self.assertEqual(index.count(''), 1)
+        index._thread.join()
+        self.assertEqual(index.count(''), 5)
+
+    def test_columnar_listing(self):
+        """
+        ColumnarListing (same results as filtering/sorting FileObjects)
+
+        # for_filelisting
+        # files
+        """
+        if filebrowser.columnar.numpy is None:
+            return
+        self.assertEqual(ColumnarListing.for_filelisting(self.f_listing, 3), None)
+        columnar = ColumnarListing.for_filelisting(self.f_listing, 1)
+        self.assertEqual(len(columnar), 2)
+        self.assertEqual(list(f.path for f in columnar.files()), [u'fb_test_directory/testimage.jpg', u'fb_test_directory/fb_tmp_dir'])
+        self.assertEqual(list(f.path for f in columnar.files(filter_type='Folder')), [u'fb_test_directory/fb_tmp_dir'])
+        self.assertEqual(list(f.path for f in columnar.files(filter_date='past7days')), [u'fb_test_directory/testimage.jpg', u'fb_test_directory/fb_tmp_dir'])
+        self.assertEqual(len(columnar.files(filter_date='bogus')), 0)
+        self.assertEqual(columnar.files()[0].filesize, 870037)
+
+    def test_counters(self):
+        """
+        FileListing counters (without building the listing)
+
+        # results_listing_total
+        # results_walk_total
+        # results_listing_filtered
+        # results_walk_filtered
+        # files_walk_head
+        """
+        self.assertEqual(self.f_listing.results_listing_total(), 2)
+        self.assertEqual(self.f_listing._fileobjects_total, None)
+        self.assertEqual(self.f_listing.results_walk_total(), 4)
+        f_listing = FileListing(self.directory, filter_func=lambda f: f.filetype == 'Image')
+        self.assertEqual(f_listing.results_listing_filtered(), 1)
+        self.assertEqual(f_listing.results_walk_filtered(), 2)
+        head, results = FileListing(self.directory, sorting_by='filename_lower', sorting_order='asc').files_walk_head(1)
+        self.assertEqual(list(f.path for f in head), [u'fb_test_directory/fb_tmp_dir'])
+        self.assertEqual(results, 4)
+
+    def test_folder_aggregates(self):
+        """
+        FileObject folder aggregates
+
+        # folder_size
+        # folder_count
+        """
+        folder = FileObject(self.directory, site=site)
+        self.assertEqual(folder.folder_size, 870037 * 2)
+        self.assertEqual(folder.folder_count, 4)
+        self.assertEqual(FileObject(os.path.join(self.directory, "testimage.jpg"), site=site).folder_size, 870037)
+        self.assertEqual(FileObject(os.path.join(self.directory, "testimage.jpg"), site=site).folder_count, 0)
+        # changed subdirectories are computed again
+        shutil.copy(self.image_path, os.path.join(self.tmpdir_path, "testimage2.jpg"))
+        self.assertEqual(FileObject(self.directory, site=site).folder_count, 5)
+        f_listing = FileListing(self.directory, sorting_by='folder_size', sorting_order='desc')
+        self.assertEqual(list(f.path for f in f_listing.files_listing_total()), [u'fb_test_directory/fb_tmp_dir', u'fb_test_directory/testimage.jpg'])
+
+    def test_metadata_index(self):
+        """
+        FileListing with a MetadataIndex
+
+        # files_listing_total
+        # results_listing_total
+        # MetadataIndex.refresh
+        """
+        index_dir = tempfile.mkdtemp()
+        original_metadata_index = site.metadata_index
+        site.metadata_index = MetadataIndex(site, os.path.join(index_dir, "filebrowser.sqlite3"))
+        try:
+            f_listing = FileListing(self.directory, sorting_by='date', sorting_order='desc')
+            self.assertEqual(list(f.path for f in f_listing.files_listing_total()), [u'fb_test_directory/testimage.jpg', u'fb_test_directory/fb_tmp_dir'])
+            self.assertEqual(f_listing.files_listing_total()[0].filesize, 870037)
+            self.assertEqual(FileListing(self.directory).results_listing_total(), 2)
+            # sorted like without the index (equal items in the same order as well)
+            for sorting_by, sorting_order in [('filetype', 'asc'), ('filetype', 'desc'), ('filesize', 'desc'), ('date', 'asc')]:
+                indexed = [f.path for f in FileListing(self.directory, sorting_by=sorting_by, sorting_order=sorting_order).files_listing_total()]
+                site.metadata_index = None
+                self.assertEqual([f.path for f in FileListing(self.directory, sorting_by=sorting_by, sorting_order=sorting_order).files_listing_total()], indexed)
+                site.metadata_index = MetadataIndex(site, os.path.join(index_dir, "filebrowser.sqlite3"))
+            # filtered and sorted (with the direction) by the index
+            self.assertEqual(site.metadata_index.entries(self.directory, sorting_by='filename', sorting_order='desc')[0][0], u'testimage.jpg')
+            self.assertEqual(site.metadata_index.entries(self.directory, filter_name_func=lambda name: name.endswith('.jpg'))[0][0], u'testimage.jpg')
+            self.assertEqual(FileListing(self.directory, filter_name_func=lambda name: name.endswith('.jpg')).results_listing_total(), 1)
+            # versions are left out by the index with versions=False
+            shutil.copy(self.image_path, os.path.join(self.directory_path, "testimage_large.jpg"))
+            site.metadata_index.invalidate(self.directory)
+            self.assertEqual(site.metadata_index.count(self.directory), 3)
+            self.assertEqual(site.metadata_index.count(self.directory, versions=False), 2)
+            self.assertEqual(FileListing(self.directory, filter_name_func=site.filter_browse).results_listing_total(), 2)
+            os.remove(os.path.join(self.directory_path, "testimage_large.jpg"))
+            site.metadata_index.invalidate(self.directory)
+            # unchanged directories are not listed again
+            self.assertEqual(site.metadata_index.refresh(self.directory), 0)
+            self.assertEqual(site.metadata_index.refresh(self.directory, recursive=True, dimensions=True), 2)
+            self.assertEqual(site.metadata_index.entries(os.path.join(self.directory, self.tmpdir_name))[0][4:], (1000, 750))
+            # removed folders are removed from the index
+            shutil.rmtree(os.path.join(self.directory_path, "fb_tmp_dir"))
+            site.metadata_index.invalidate(self.directory)
+            self.assertEqual(FileListing(self.directory).results_listing_total(), 1)
+            self.assertEqual(site.metadata_index.entries(os.path.join(self.directory, self.tmpdir_name)), [])
+        finally:
+            site.metadata_index = original_metadata_index
+            shutil.rmtree(index_dir)
+
     def tearDown(self):
         """
         Restore original values/functions
@@ -16,6 +16,7 @@ import sys
 # DJANGO IMPORTS
 from django.test import TestCase
 from django.test.client import Client
+from django.core.files.base import ContentFile
 from django.core.urlresolvers import get_resolver, get_urlconf, reverse
 try:
     from django.utils.six.moves.urllib.parse import urlencode
@@ -320,6 +321,48 @@ def test_detail(test):
         test.assertFalse(test.site.storage.exists(path))
 
 
+def test_version_file(test):
+    """
+    Check the version view (version generated with the first request, conditional requests).
+    """
+    version_suffix = sorted(VERSIONS)[0]
+    url = reverse('%s:fb_version_file' % test.site_name, kwargs={'version_suffix': version_suffix, 'path': test.testfile.path_relative_directory})
+    response = test.c.get(url)
+
+    # Check we get an OK response and the version has been generated
+    test.assertTrue(response.status_code == 200)
+    test.assertTrue(test.site.storage.exists(test.testfile.version_path(version_suffix)))
+    test.assertTrue(response['ETag'])
+    test.assertTrue(response['Cache-Control'].startswith('private'))
+
+    # Check we get 304 responses for conditional requests (with the ETag only)
+    response = test.c.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+    test.assertTrue(response.status_code == 304)
+    response = test.c.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+    test.assertTrue(response.status_code == 200)
+
+    # Check we get a redirect to the login (unless VERSION_FILE_PUBLIC)
+    test.c.logout()
+    test.assertTrue(test.c.get(url).status_code == 302)
+    test.c.login(username='site_tester', password='secret')
+
+    # Check we get 404 responses for wrong versions and paths outside of the directory
+    url = reverse('%s:fb_version_file' % test.site_name, kwargs={'version_suffix': 'wrong_suffix', 'path': test.testfile.path_relative_directory})
+    test.assertTrue(test.c.get(url).status_code == 404)
+    url = reverse('%s:fb_version_file' % test.site_name, kwargs={'version_suffix': version_suffix, 'path': '../' + test.testfile.path})
+    test.assertTrue(test.c.get(url).status_code == 404)
+    url = reverse('%s:fb_version_file' % test.site_name, kwargs={'version_suffix': version_suffix, 'path': '.hidden/' + test.testfile.filename})
+    test.assertTrue(test.c.get(url).status_code == 404)
+
+    # Check we get a 404 response for images which can not be decoded
+    corrupt_path = test.site.storage.save(os.path.join(test.testfile.head, 'corrupt.jpg'), ContentFile(b'not an image'))
+    try:
+        url = reverse('%s:fb_version_file' % test.site_name, kwargs={'version_suffix': version_suffix, 'path': FileObject(corrupt_path, site=test.site).path_relative_directory})
+        test.assertTrue(test.c.get(url).status_code == 404)
+    finally:
+        test.site.storage.delete(corrupt_path)
+
+
 def test_delete_confirm(test):
     """
     Check that the delete view functions as expected. Does not check the deletion itself,
@@ -400,6 +443,7 @@ def runTest(self):
     test_overwrite(self)
     test_convert_normalize(self)
     test_detail(self)
+    test_version_file(self)
     test_delete_confirm(self)
     test_delete(self)
 
@@ -19,6 +19,7 @@ from filebrowser.settings import DEFAULT_PERMISSIONS
 from filebrowser.base import FileObject, FileListing
 from filebrowser.templatetags.fb_versions import version, version_object, version_setting
 from filebrowser.sites import site
+from filebrowser.versions import version_generator
 
 TESTS_PATH = os.path.dirname(os.path.abspath(__file__))
 FILEBROWSER_PATH = os.path.split(TESTS_PATH)[0]
@@ -38,6 +39,7 @@ class VersionTemplateTagsTests(TestCase):
         self.original_placeholder = filebrowser.templatetags.fb_versions.PLACEHOLDER
         self.original_show_placeholder = filebrowser.templatetags.fb_versions.SHOW_PLACEHOLDER
         self.original_force_placeholder = filebrowser.templatetags.fb_versions.FORCE_PLACEHOLDER
+        self.original_version_generate_async = filebrowser.templatetags.fb_versions.VERSION_GENERATE_ASYNC
 
         # DIRECTORY
         # custom directory because this could be set with sites
@@ -270,6 +272,41 @@ class VersionTemplateTagsTests(TestCase):
         self.assertEqual(c["version_large"].url, os.path.join(settings.MEDIA_URL, "fb_test_directory/_versions/fb_tmp_dir/fb_tmp_placeholder/testimage_large.jpg"))
         self.assertEqual(r, os.path.join(settings.MEDIA_URL, "fb_test_directory/_versions/fb_tmp_dir/fb_tmp_placeholder/testimage_large.jpg"))
 
+    def test_version_async(self):
+        """
+        Templatetags version and version_object with VERSION_GENERATE_ASYNC
+        """
+        # new settings
+        filebrowser.base.VERSIONS_BASEDIR = "fb_test_directory/_versions"
+        filebrowser.base.VERSIONS = {
+            'large': {'verbose_name': 'Large', 'width': 600, 'height': '', 'opts': ''},
+        }
+        filebrowser.settings.VERSIONS = filebrowser.base.VERSIONS
+        filebrowser.templatetags.fb_versions.VERSIONS = filebrowser.base.VERSIONS
+        filebrowser.templatetags.fb_versions.VERSION_GENERATE_ASYNC = True
+        filebrowser.templatetags.fb_versions.PLACEHOLDER = ""
+
+        # the original is returned until the version has been generated
+        t = Template('{% load fb_versions %}{% version obj "large" %}')
+        c = Context({"obj": self.f_image})
+        r = t.render(c)
+        self.assertEqual(r, os.path.join(settings.MEDIA_URL, "fb_test_directory/fb_tmp_dir/fb_tmp_dir_sub/testimage.jpg"))
+        version_generator.wait()
+        self.assertEqual(version_generator.pending(), 0)
+        r = t.render(c)
+        self.assertEqual(r, os.path.join(settings.MEDIA_URL, "fb_test_directory/_versions/fb_tmp_dir/fb_tmp_dir_sub/testimage_large.jpg"))
+
+        # the version of the placeholder is returned until the version has been generated
+        self.f_image.delete_versions()
+        filebrowser.templatetags.fb_versions.PLACEHOLDER = "fb_test_directory/fb_tmp_dir/fb_tmp_placeholder/testimage.jpg"
+        t = Template('{% load fb_versions %}{% version_object obj "large" as version_large %}{{ version_large.url }}')
+        c = Context({"obj": self.f_image})
+        r = t.render(c)
+        self.assertEqual(r, os.path.join(settings.MEDIA_URL, "fb_test_directory/_versions/fb_tmp_dir/fb_tmp_placeholder/testimage_large.jpg"))
+        version_generator.wait()
+        r = t.render(c)
+        self.assertEqual(r, os.path.join(settings.MEDIA_URL, "fb_test_directory/_versions/fb_tmp_dir/fb_tmp_dir_sub/testimage_large.jpg"))
+
     def test_version_setting(self):
         pass
 
@@ -287,6 +324,7 @@ class VersionTemplateTagsTests(TestCase):
         filebrowser.templatetags.fb_versions.PLACEHOLDER = self.original_placeholder
         filebrowser.templatetags.fb_versions.SHOW_PLACEHOLDER = self.original_show_placeholder
         filebrowser.templatetags.fb_versions.FORCE_PLACEHOLDER = self.original_force_placeholder
+        filebrowser.templatetags.fb_versions.VERSION_GENERATE_ASYNC = self.original_version_generate_async
 
         # remove temporary directory and test folder
         shutil.rmtree(self.directory_path)
@@ -5,12 +5,16 @@ import re
 import os
 import unicodedata
 import math
+import stat
+import struct
+import time
+import datetime
 
 # DJANGO IMPORTS
 from django.utils import six
 
 # FILEBROWSER IMPORTS
-from filebrowser.settings import STRICT_PIL, NORMALIZE_FILENAME, CONVERT_FILENAME
+from filebrowser.settings import STRICT_PIL, NORMALIZE_FILENAME, CONVERT_FILENAME, EXCLUDE, VERSIONS, EXTENSION_LIST
 
 # PIL import
 if STRICT_PIL:
@@ -46,6 +50,215 @@ def convert_filename(value):
     return value
 
 
+# Hash within the name of a version (see VERSION_NAMES_HASHED)
+VERSION_HASH_PATTERN = r'\.[0-9a-f]{12}'
+
+
+def version_signature(options):
+    "Representation of the settings of a version (see VERSIONS) which is the same with every process"
+    def value(item):
+        if callable(item):
+            # not the address of a function
+            return '%s.%s' % (getattr(item, '__module__', ''), getattr(item, '__name__', item.__class__.__name__))
+        if isinstance(item, (list, tuple)):
+            return [value(i) for i in item]
+        return item
+    return repr(sorted((key, value(item)) for key, item in options.items()))
+
+
+class ExcludeFunc(object):
+    "Callable name -> True, if the name matches one of the compiled expressions (can be pickled, unlike a lambda)"
+
+    def __init__(self, exclude_re_list):
+        self.exclude_re_list = exclude_re_list
+
+    def __call__(self, name):
+        return any(exclude_re.search(name) for exclude_re in self.exclude_re_list)
+
+
+def get_exclude_func(exclude=EXCLUDE, versions=VERSIONS, extensions=EXTENSION_LIST, hidden=True):
+    """
+    Returns a callable name -> True, if the filename is excluded with browse
+    (see ExcludeFunc).
+
+    Hidden files (with hidden=True), the exclude list and version suffixes
+    (case-insensitive) are compiled into one regular expression. If this is
+    not possible (scoped flags require Python 3.6), the expressions are
+    compiled separately.
+    """
+    patterns = list(exclude)
+    if hidden:
+        patterns.insert(0, r'^\.')
+    version_pattern = None
+    if versions:
+        # also versions with a hash (see VERSION_NAMES_HASHED)
+        version_pattern = r'_(?:%s)(?:%s)?(?:%s)$' % ('|'.join(versions), VERSION_HASH_PATTERN, '|'.join(extensions))
+    try:
+        if version_pattern:
+            exclude_re = re.compile('|'.join(['(?:%s)' % exp for exp in patterns] + ['(?i:%s)' % version_pattern]))
+        else:
+            exclude_re = re.compile('|'.join(['(?:%s)' % exp for exp in patterns]) or '(?!)')
+        return ExcludeFunc([exclude_re])
+    except re.error:
+        pass
+    exclude_re_list = [re.compile(exp) for exp in patterns]
+    if version_pattern:
+        exclude_re_list.append(re.compile(version_pattern, re.IGNORECASE))
+    return ExcludeFunc(exclude_re_list)
+
+
+def get_directory_mtime(storage, path):
+    """
+    Modification time of a directory as float (with one stat for local storages).
+    None, if path is no directory or the storage does not know it.
+    """
+    try:
+        st = os.stat(storage.path(path))
+        if not stat.S_ISDIR(st.st_mode):
+            return None
+        return st.st_mtime
+    except NotImplementedError:
+        pass
+    except OSError:
+        return None
+    try:
+        return time.mktime(storage.modified_time(path).timetuple())
+    except Exception:
+        return None
+
+
+def normalize_mtime(mtime):
+    """
+    Modification time (as returned with os.stat) in whole seconds, the same
+    as FileObject.date with storage.modified_time.
+    """
+    return time.mktime(datetime.datetime.fromtimestamp(mtime).timetuple())
+
+
+class _HeaderReader(object):
+    "Reads a header with reader(offset, length), chunk bytes at a time"
+
+    def __init__(self, reader, chunk=4096):
+        self.reader = reader
+        self.chunk = chunk
+        self.offset = 0
+        self.data = b''
+
+    def read(self, offset, length):
+        if offset < self.offset or offset + length > self.offset + len(self.data):
+            self.offset = offset
+            self.data = self.reader(offset, max(length, self.chunk)) or b''
+        data = self.data[offset - self.offset:offset - self.offset + length]
+        if len(data) < length:
+            raise ValueError("Unexpected end of header")
+        return data
+
+
+# JPEG start of frame markers (without DHT, JPG and DAC)
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - set((0xC4, 0xC8, 0xCC))
+# color modes (like PIL) of JPEG components and PNG color types (with 8 bits)
+JPEG_MODES = {1: 'L', 3: 'RGB', 4: 'CMYK'}
+PNG_MODES = {0: 'L', 2: 'RGB', 3: 'P', 4: 'LA', 6: 'RGBA'}
+
+
+def _jpeg_info(header):
+    offset = 2
+    # segments are only skipped (e.g. large EXIF data), so this is a few reads at most
+    for i in range(1000):
+        marker, code = struct.unpack('>BB', header.read(offset, 2))
+        if marker != 0xFF:
+            return None
+        if code == 0xFF:
+            # fill byte
+            offset += 1
+            continue
+        if code in JPEG_SOF_MARKERS:
+            height, width, components = struct.unpack('>HHB', header.read(offset + 5, 5))
+            return width, height, 'JPEG', JPEG_MODES.get(components)
+        if code == 0x01 or 0xD0 <= code <= 0xD9:
+            # markers without a segment
+            offset += 2
+            continue
+        length, = struct.unpack('>H', header.read(offset + 2, 2))
+        if length < 2:
+            return None
+        offset += 2 + length
+    return None
+
+
+def _png_info(signature):
+    width, height, depth, color_type = struct.unpack('>IIBB', signature[16:26])
+    mode = None
+    if depth == 1 and color_type == 0:
+        mode = '1'
+    elif depth == 8 or color_type == 3:
+        mode = PNG_MODES.get(color_type)
+    return width, height, 'PNG', mode
+
+
+def _tiff_info(header, byteorder):
+    ifd_offset, = struct.unpack(byteorder + 'I', header.read(4, 4))
+    count, = struct.unpack(byteorder + 'H', header.read(ifd_offset, 2))
+    values = {}
+    for i in range(count):
+        tag, field_type = struct.unpack(byteorder + 'HH', header.read(ifd_offset + 2 + i * 12, 4))
+        if tag in (256, 257):
+            # ImageWidth, ImageLength (SHORT or LONG)
+            value_format = field_type == 3 and 'H' or 'I'
+            values[tag], = struct.unpack(byteorder + value_format, header.read(ifd_offset + 2 + i * 12 + 8, struct.calcsize(value_format)))
+    if 256 in values and 257 in values:
+        return values[256], values[257], 'TIFF', None
+    return None
+
+
+def get_image_info(reader):
+    """
+    (width, height, format, mode) of a JPEG, PNG, GIF or TIFF image,
+    parsed from its header (None for other formats or invalid headers).
+    format and mode are named like with PIL, mode is None if it can
+    not be determined from the header.
+
+    reader(offset, length) returns (at most) length bytes of the file
+    starting with offset (e.g. with a ranged request, see
+    StorageMixin.read_range). Only the header is read, usually with
+    a single call.
+    """
+    header = _HeaderReader(reader)
+    try:
+        signature = header.read(0, 26)
+    except ValueError:
+        try:
+            signature = header.read(0, 10)
+        except ValueError:
+            return None
+    try:
+        if signature.startswith(b'\x89PNG\r\n\x1a\n') and signature[12:16] == b'IHDR':
+            return _png_info(signature)
+        if signature[:6] in (b'GIF87a', b'GIF89a'):
+            # PIL opens GIFs with either P or L
+            return struct.unpack('<HH', signature[6:10]) + ('GIF', None)
+        if signature.startswith(b'\xff\xd8'):
+            return _jpeg_info(header)
+        if signature[:4] == b'II*\x00':
+            return _tiff_info(header, '<')
+        if signature[:4] == b'MM\x00*':
+            return _tiff_info(header, '>')
+    except (ValueError, struct.error):
+        pass
+    return None
+
+
+def get_image_dimensions(reader):
+    """
+    Dimensions (width, height) of a JPEG, PNG, GIF or TIFF image,
+    parsed from its header (see get_image_info).
+    """
+    info = get_image_info(reader)
+    if info is None:
+        return None
+    return info[:2]
+
+
 def path_strip(path, root):
     if not path or not root:
         return path
@@ -56,12 +269,14 @@ def path_strip(path, root):
     return path
 
 
-def scale_and_crop(im, width, height, opts):
+def scale_and_crop_plan(size, width, height, opts):
     """
-    Scale and Crop.
+    Resize and crop of scale_and_crop for an image with size (width, height):
+    (new size or None, crop box or None). False, if the image should not
+    be scaled (see scale_and_crop).
     """
 
-    x, y = [float(v) for v in im.size]
+    x, y = [float(v) for v in size]
 
     if 'upscale' not in opts and x < width:
         # version would be bigger than original
@@ -82,14 +297,55 @@ def scale_and_crop(im, width, height, opts):
     else:
         r = min(xr/x, yr/y)
 
+    resize = None
     if r < 1.0 or (r > 1.0 and 'upscale' in opts):
-        im = im.resize((int(math.ceil(x*r)), int(math.ceil(y*r))), resample=Image.ANTIALIAS)
+        resize = (int(math.ceil(x*r)), int(math.ceil(y*r)))
+        x, y = [float(v) for v in resize]
 
+    crop = None
     if 'crop' in opts:
-        x, y = [float(v) for v in im.size]
         ex, ey = (x-min(x, xr))/2, (y-min(y, yr))/2
         if ex or ey:
-            im = im.crop((int(ex), int(ey), int(ex+xr), int(ey+yr)))
+            crop = (int(ex), int(ey), int(ex+xr), int(ey+yr))
+    return resize, crop
+
+
+def draft_size(size, reducing_gap):
+    "Minimum size of an image to be resized to size with reducing_gap (see resize_image)"
+    return (int(size[0] * reducing_gap), int(size[1] * reducing_gap))
+
+
+def resize_image(im, size, reducing_gap=None):
+    """
+    Resize im to size (with ANTIALIAS).
+
+    With reducing_gap, a JPEG which has not been loaded yet is decoded with
+    DCT scaling (see Image.draft) and other images are reduced by an integer
+    factor first (with PIL >= 7.0), as long as the image stays at least
+    reducing_gap times larger than size. Faster (and with less memory),
+    with almost the same result for reducing_gap >= 2.
+    """
+    if reducing_gap:
+        if getattr(im, 'tile', None) and im.format == 'JPEG':
+            im.draft(im.mode, draft_size(size, reducing_gap))
+        if hasattr(im, 'reduce'):
+            return im.resize(size, resample=Image.ANTIALIAS, reducing_gap=reducing_gap)
+    return im.resize(size, resample=Image.ANTIALIAS)
+
+
+def scale_and_crop(im, width, height, opts, reducing_gap=None):
+    """
+    Scale and Crop.
+    """
+
+    plan = scale_and_crop_plan(im.size, width, height, opts)
+    if plan is False:
+        return False
+    resize, crop = plan
+    if resize:
+        im = resize_image(im, resize, reducing_gap)
+    if crop:
+        im = im.crop(crop)
     return im
 
 scale_and_crop.valid_options = ('crop', 'upscale')
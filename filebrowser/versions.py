@@ -0,0 +1,228 @@
+# coding: utf-8
+
+# PYTHON IMPORTS
+import os
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+
+# fcntl is not available with Windows (see VERSION_LOCK_DIR)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# DJANGO IMPORTS
+from django.utils.encoding import force_bytes
+
+# FILEBROWSER IMPORTS
+from filebrowser.settings import VERSION_GENERATE_WORKERS, VERSION_GENERATE_MAX_PENDING, VERSION_LOCK_DIR, VERSION_LOCK_TIMEOUT
+from filebrowser.cache import get_cache
+
+
+class VersionManifest(object):
+    """
+    Records the versions of the images of a FileBrowserSite, so returning
+    a version which is up to date does not access the storage
+    (see FileObject.version_generate).
+
+    For every original and version suffix, the manifest holds the
+    modification time of the original (when the version has been checked
+    or generated) together with path and modification time of the version.
+    Entries are only used while the modification time of the original is
+    unchanged. Versions deleted with FileBrowser are removed from the
+    manifest, versions deleted otherwise are checked again after timeout
+    seconds.
+
+    cache: see filebrowser.cache.get_cache.
+    """
+
+    def __init__(self, site, cache=None, timeout=86400, max_entries=10000):
+        self.site = site
+        self.timeout = timeout
+        self.cache = get_cache(cache, timeout, max_entries)
+
+    def _key(self, path, version_suffix):
+        digest = hashlib.md5(force_bytes(path)).hexdigest()
+        return 'filebrowser:version:%s:%s:%s' % (self.site.name, digest, version_suffix)
+
+    def get(self, path, mtime, version_suffix):
+        "(path, modification time) of the version of path, None if unknown or outdated"
+        if mtime is None:
+            return None
+        entry = self.cache.get(self._key(path, version_suffix))
+        if entry is None or entry[0] != mtime:
+            return None
+        return entry[1:]
+
+    def set(self, path, mtime, version_suffix, version_path, version_mtime):
+        "Record a version of path (with mtime being the modification time of path)"
+        if mtime is None:
+            return
+        self.cache.set(self._key(path, version_suffix), (mtime, version_path, version_mtime), self.timeout)
+
+    def invalidate(self, path, version_suffixes):
+        "Remove the versions of path from the manifest"
+        for version_suffix in version_suffixes:
+            self.cache.delete(self._key(path, version_suffix))
+
+
+class VersionLock(object):
+    """
+    Single-flight lock for generating the versions of an image, so
+    concurrent requests for a new image do not generate its versions
+    again (see FileObject.versions_generate).
+
+    Within a process, a lock per image is used. With a directory (and
+    fcntl), a lock file per image is locked as well, for other processes
+    and hosts sharing the directory (lock files are not removed).
+    Locks are given up after timeout seconds.
+    """
+
+    def __init__(self, directory=None, timeout=30, interval=0.05):
+        self.directory = directory
+        self.timeout = timeout
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._locks = {}
+
+    def _key(self, site, path):
+        return hashlib.md5(force_bytes('%s:%s' % (site.name, path))).hexdigest()
+
+    def _acquire(self, acquire, deadline):
+        """
+        Call acquire (without blocking) until it returns True or deadline has passed.
+        Returns (acquired, waited).
+        """
+        waited = False
+        while not acquire():
+            if time.time() >= deadline:
+                return False, True
+            waited = True
+            time.sleep(self.interval)
+        return True, waited
+
+    def _lockfile(self, key):
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                # created by another process
+                pass
+        f = open(os.path.join(self.directory, '%s.lock' % key), 'a')
+
+        def acquire():
+            try:
+                fcntl.lockf(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except IOError:
+                return False
+        return f, acquire
+
+    @contextmanager
+    def hold(self, site, path):
+        """
+        Hold the lock for the image path (of site). Yields True if another
+        thread/process has held the lock meanwhile (or the lock has not been
+        acquired before timeout), so versions might have been generated.
+        """
+        key = self._key(site, path)
+        deadline = time.time() + self.timeout
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        locked, waited = self._acquire(lambda: entry[0].acquire(False), deadline)
+        f = None
+        try:
+            if locked and self.directory and fcntl is not None:
+                f, acquire_file = self._lockfile(key)
+                waited = self._acquire(acquire_file, deadline)[1] or waited
+            yield waited
+        finally:
+            if f is not None:
+                # also releases the lock of the file
+                f.close()
+            with self._lock:
+                if locked:
+                    entry[0].release()
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+
+class VersionGenerator(object):
+    """
+    Generates versions in the background (see VERSION_GENERATE_ASYNC),
+    with a bounded pool of threads (started when used first). With a
+    VersionJobQueue (see VERSION_QUEUE_DIR), versions are queued with the
+    site instead (and generated with fb_worker).
+
+    A version (site, path and suffix) is only queued once until it has
+    been generated. With max_pending versions waiting, further versions
+    are not queued (but again when requested again).
+    """
+
+    def __init__(self, workers=2, max_pending=1000):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._condition = threading.Condition()
+        self._pending = set()
+        self._pool = None
+
+    def submit(self, fileobject, version_suffix):
+        "Queue the generation of a version. Returns False if the version has not been queued."
+        key = (fileobject.site.name, fileobject.path, version_suffix)
+        with self._condition:
+            if key in self._pending or len(self._pending) >= self.max_pending:
+                return False
+            self._pending.add(key)
+            if self._pool is None:
+                self._pool = ThreadPool(self.workers)
+        # a FileObject of its own, not shared with the thread rendering the template
+        fileobject = fileobject.__class__(fileobject.path, site=fileobject.site)
+        self._pool.apply_async(self._generate, (key, fileobject, version_suffix))
+        return True
+
+    def _generate(self, key, fileobject, version_suffix):
+        try:
+            fileobject.version_generate(version_suffix)
+        except Exception:
+            # errors are raised with the next (synchronous) attempt
+            pass
+        finally:
+            with self._condition:
+                self._pending.discard(key)
+                self._condition.notify_all()
+
+    def version(self, fileobject, version_suffix, fallback):
+        """
+        The version of fileobject if it exists and is up to date. Otherwise,
+        the version is queued and fallback is returned.
+        """
+        version = fileobject.version_get(version_suffix)
+        if version is None:
+            version_queue = getattr(fileobject.site, 'version_queue', None)
+            if version_queue is not None:
+                version_queue.enqueue(fileobject.path, [version_suffix], retry=False)
+            else:
+                self.submit(fileobject, version_suffix)
+            return fallback
+        return version
+
+    def pending(self):
+        "Number of versions waiting to be generated"
+        with self._condition:
+            return len(self._pending)
+
+    def wait(self):
+        "Wait until all queued versions have been generated"
+        with self._condition:
+            while self._pending:
+                self._condition.wait()
+
+
+# Locks and generates versions for all sites of this process
+version_lock = VersionLock(VERSION_LOCK_DIR, VERSION_LOCK_TIMEOUT)
+version_generator = VersionGenerator(VERSION_GENERATE_WORKERS, VERSION_GENERATE_MAX_PENDING)